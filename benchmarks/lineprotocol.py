@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Measure how many callhome points per second each way of turning them
+into line protocol handles, without needing an InfluxDB.
+
+    python3 benchmarks/lineprotocol.py [<points>] [<rounds>]
+"""
+
+import copy
+import os
+import sys
+import time
+
+from influxdb.line_protocol import make_lines
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from omniscient.lineprotocol import LineEncoder, encode_point  # noqa: E402
+
+UUID = "14139363-d4fe-304c-8d01-127d0e75383c"
+
+
+def make_points(count: int) -> list:
+    """
+    Points like the ones a worker sends, spread over a few tests.
+    """
+
+    return [
+        {
+            "measurement": f"test_{i % 20}",
+            "tags": {"uuid": UUID},
+            "fields": {"success": True, "result": i * 0.5, "loss": i % 3},
+            "time": 1700000000000000000 + i,
+        }
+        for i in range(count)
+    ]
+
+
+def json_path(points: list, tags: dict) -> list:
+    """
+    The old path: tag the parsed dicts and let the InfluxDB client
+    serialize them.
+    """
+
+    for point in points:
+        point["tags"].update(tags)
+
+    return make_lines({"points": points}).splitlines()
+
+
+def function_path(points: list, tags: dict) -> list:
+    return [encode_point(point, tags) for point in points]
+
+
+def encoder_path(points: list, tags: dict, encoder: LineEncoder = LineEncoder()) -> list:
+    return encoder.encode(points, tags)
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    tags = {"uuid": UUID, "alias": "worker 1"}
+    points = make_points(count)
+
+    for name, func in (("json", json_path), ("encode_point", function_path),
+                       ("LineEncoder", encoder_path)):
+        best = None
+
+        for _ in range(rounds):
+            # The old path modifies the points, give it fresh ones
+            batch = copy.deepcopy(points) if func is json_path else points
+
+            started = time.perf_counter()
+            lines = func(batch, tags)
+            elapsed = time.perf_counter() - started
+
+            assert len(lines) == count
+            best = elapsed if best is None else min(best, elapsed)
+
+        print(f"{name:>14}: {count / best:12,.0f} points/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Measure how many points per second the local sinks take in batches
+like the ones the master's writer hands them.
+
+    python3 benchmarks/sinks.py [<points>] [<batch size>]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from omniscient.sink import FileSink, SQLiteSink  # noqa: E402
+
+
+def make_lines(count: int) -> list:
+    return [
+        f"test_{i % 20},alias=worker\\ 1,uuid=14139363-d4fe-304c-8d01-127d0e75383c "
+        f"loss={i % 3}i,result={i * 0.5},success=true {1700000000000000000 + i}"
+        for i in range(count)
+    ]
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    lines = make_lines(count)
+
+    with tempfile.TemporaryDirectory() as path:
+        for name, sink in (("file", FileSink(os.path.join(path, "points.lp"))),
+                           ("sqlite", SQLiteSink(os.path.join(path, "points.db")))):
+            started = time.perf_counter()
+
+            for i in range(0, count, batch_size):
+                sink.write(lines[i:i + batch_size])
+
+            elapsed = time.perf_counter() - started
+            sink.close()
+
+            print(f"{name:>8}: {count / elapsed:12,.0f} points/s")
+
+
+if __name__ == "__main__":
+    main()
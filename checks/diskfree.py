@@ -0,0 +1,19 @@
+import os
+
+
+def check(args: list, timeout: float) -> dict:
+    """
+    Report free space on the file system holding a path. Arguments:
+    [path]. Sizes are in MiB.
+    """
+
+    st = os.statvfs(args[0] if args else ".")
+
+    total = st.f_blocks * st.f_frsize
+    free = st.f_bavail * st.f_frsize
+
+    return {
+        "free": free // (1024 * 1024),
+        "total": total // (1024 * 1024),
+        "used_percent": 100.0 * (total - free) / total if total else 0.0,
+    }
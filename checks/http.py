@@ -0,0 +1,34 @@
+import http.client
+import time
+import urllib.parse
+
+
+def check(args: list, timeout: float) -> dict:
+    """
+    Request a URL without following redirects. Arguments: url. Reports
+    the status code and the time to the response headers in
+    milliseconds.
+    """
+
+    url = urllib.parse.urlsplit(args[0])
+    timeout = timeout or 10
+
+    if url.scheme == "https":
+        conn = http.client.HTTPSConnection(url.hostname, url.port, timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+
+    path = url.path or "/"
+    if url.query:
+        path += "?" + url.query
+
+    started = time.monotonic()
+
+    try:
+        conn.request("GET", path, headers={"User-Agent": "omniscient"})
+        res = conn.getresponse()
+        latency = (time.monotonic() - started) * 1000
+    finally:
+        conn.close()
+
+    return {"status": res.status, "latency": latency}
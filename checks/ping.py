@@ -0,0 +1,59 @@
+import os
+import socket
+import struct
+import time
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def check(args: list, timeout: float) -> dict:
+    """
+    Ping a host with ICMP echo over an unprivileged datagram socket.
+    Arguments: host [count]. Reports the average round trip time in
+    milliseconds and the packet loss in percent.
+    """
+
+    host = args[0]
+    count = int(args[1]) if len(args) > 1 else 1
+    timeout = timeout or 5
+    deadline = time.monotonic() + timeout
+
+    addr = socket.gethostbyname(host)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    rtts = []
+
+    with sock:
+        for seq in range(1, count + 1):
+            payload = os.urandom(16)
+            header = struct.pack("!BBHHH", 8, 0, 0, 0, seq)
+            packet = struct.pack("!BBHHH", 8, 0, checksum(header + payload), 0, seq) + payload
+
+            sent = time.monotonic()
+            sock.sendto(packet, (addr, 0))
+
+            while True:
+                remaining = min(deadline - time.monotonic(), timeout / count)
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    reply = sock.recv(1024)
+                except socket.timeout:
+                    break
+                # The kernel strips the IP header and sets the identifier
+                if (reply[0] == 0 and struct.unpack("!H", reply[6:8])[0] == seq
+                        and reply[8:] == payload):
+                    rtts.append((time.monotonic() - sent) * 1000)
+                    break
+
+    return {
+        "rtt": sum(rtts) / len(rtts) if rtts else None,
+        "loss": 100.0 * (count - len(rtts)) / count,
+    }
@@ -0,0 +1,17 @@
+import socket
+import time
+
+
+def check(args: list, timeout: float) -> dict:
+    """
+    Open a TCP connection. Arguments: host port. Reports the time to
+    connect in milliseconds.
+    """
+
+    host, port = args[0], int(args[1])
+    started = time.monotonic()
+
+    with socket.create_connection((host, port), timeout=timeout or 10):
+        connect = (time.monotonic() - started) * 1000
+
+    return {"connect": connect}
@@ -2,4 +2,4 @@
 
 cd /master
 
-python3 master.py
+gunicorn -c gunicorn.conf.py master:app
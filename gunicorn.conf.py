@@ -0,0 +1,60 @@
+# Production server for the master:
+#
+#   gunicorn -c gunicorn.conf.py master:app
+#
+# Workers in watch mode (worker.py -w) keep a request to /config/watch
+# open. With the default gthread worker class every held watch ties up a
+# thread, so at most OMNISCIENT_WATCH_MAX (default 4) are held per process
+# and workers beyond that fall back to polling. For a fleet in watch mode
+# use OMNISCIENT_WORKER_CLASS=gevent, where a held watch costs a greenlet
+# and up to 90% of OMNISCIENT_WORKER_CONNECTIONS are held per process.
+# The file and sqlite sinks block the event loop while they write, use
+# the influx sink with gevent.
+#
+import multiprocessing
+import os
+import signal
+
+bind = os.environ.get("OMNISCIENT_BIND", "0.0.0.0:8080")
+workers = int(os.environ.get("OMNISCIENT_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get("OMNISCIENT_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("OMNISCIENT_THREADS", 8))
+worker_connections = int(os.environ.get("OMNISCIENT_WORKER_CONNECTIONS", 1000))
+keepalive = int(os.environ.get("OMNISCIENT_KEEPALIVE", 30))
+timeout = 90
+graceful_timeout = 30
+accesslog = "-" if os.environ.get("OMNISCIENT_ACCESSLOG") else None
+
+if worker_class == "gevent":
+    os.environ.setdefault("OMNISCIENT_WATCH_MAX", str(worker_connections * 9 // 10))
+
+
+def post_worker_init(worker):
+    """
+    Open the sinks and start their write pipelines in each worker
+    process, once gevent has patched it if it is used. Held config
+    watches are answered as soon as the process is asked to stop, so that
+    they don't hold up flushing the results.
+    """
+
+    import master
+
+    master.setup()
+
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def on_exit(sig, frame):
+        master.stop_watches()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, on_exit)
+
+
+def worker_exit(server, worker):
+    """
+    Flush buffered results before a worker process exits.
+    """
+
+    import master
+
+    master.shutdown()
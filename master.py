@@ -1,20 +1,47 @@
+import atexit
 import hashlib
 import json
 import os
-from typing import Optional
-
-from flask import Flask, jsonify, request
-from influxdb import InfluxDBClient
-
+import threading
+import time
+
+from flask import Flask, Response, abort, jsonify, request
+
+from omniscient import bundle
+from omniscient.bulk import BulkError, decode, decompress
+from omniscient.config import ConfigCache, ConfigIndex
+from omniscient.lineprotocol import LineEncoder, PointError
+from omniscient.notify import ChangeNotifier
+from omniscient.registry import CheckRegistry
+from omniscient.sink import FileSink, InfluxSink, Sink, SQLiteSink
 from omniscient.validate import config_validate
+from omniscient.writer import BatchWriter
 
 config_validate()
+config_cache = ConfigCache("config.json")
+check_registry = CheckRegistry("checks")
+encoder = LineEncoder()
 
-app = Flask(__name__, static_folder="checks")
+app = Flask(__name__, static_folder=None)
 
 INFLUX_HOST = "localhost"
 INFLUX_PORT = 8086
 INFLUX_DB = "testdb"
+INFLUX_BATCH_SIZE = 5000
+INFLUX_BATCH_AGE = 1.0
+INFLUX_QUEUE_SIZE = 100000
+INFLUX_OVERFLOW = "drop"
+INFLUX_SPILL_PATH = "/tmp/omniscient-spill.jsonl"
+INFLUX_MAX_RETRIES = 8
+SINKS = ["influx"]
+FILE_SINK_PATH = "/tmp/omniscient-points.{pid}.lp"
+FILE_SINK_SIZE = 64 * 1024 * 1024
+FILE_SINK_BACKUPS = 5
+SQLITE_SINK_PATH = "/tmp/omniscient-points.db"
+WATCH_TIMEOUT = 55
+WATCH_POLL = 1.0
+WATCH_MAX = 4
+DEBUG = False
 
 if "INFLUX_HOST" in os.environ:
     INFLUX_HOST = os.environ["INFLUX_HOST"]
@@ -22,18 +49,154 @@ if "INFLUX_PORT" in os.environ:
     INFLUX_PORT = os.environ["INFLUX_PORT"]
 if "INFLUX_DB" in os.environ:
     INFLUX_DB = os.environ["INFLUX_DB"]
+if "INFLUX_BATCH_SIZE" in os.environ:
+    INFLUX_BATCH_SIZE = int(os.environ["INFLUX_BATCH_SIZE"])
+if "INFLUX_BATCH_AGE" in os.environ:
+    INFLUX_BATCH_AGE = float(os.environ["INFLUX_BATCH_AGE"])
+if "INFLUX_QUEUE_SIZE" in os.environ:
+    INFLUX_QUEUE_SIZE = int(os.environ["INFLUX_QUEUE_SIZE"])
+if "INFLUX_OVERFLOW" in os.environ:
+    INFLUX_OVERFLOW = os.environ["INFLUX_OVERFLOW"]
+if "INFLUX_SPILL_PATH" in os.environ:
+    INFLUX_SPILL_PATH = os.environ["INFLUX_SPILL_PATH"]
+if "INFLUX_MAX_RETRIES" in os.environ:
+    INFLUX_MAX_RETRIES = int(os.environ["INFLUX_MAX_RETRIES"])
+if "OMNISCIENT_SINKS" in os.environ:
+    SINKS = [sink.strip() for sink in os.environ["OMNISCIENT_SINKS"].split(",") if sink.strip()]
+if "OMNISCIENT_FILE_SINK_PATH" in os.environ:
+    FILE_SINK_PATH = os.environ["OMNISCIENT_FILE_SINK_PATH"]
+if "OMNISCIENT_FILE_SINK_SIZE" in os.environ:
+    FILE_SINK_SIZE = int(os.environ["OMNISCIENT_FILE_SINK_SIZE"])
+if "OMNISCIENT_FILE_SINK_BACKUPS" in os.environ:
+    FILE_SINK_BACKUPS = int(os.environ["OMNISCIENT_FILE_SINK_BACKUPS"])
+if "OMNISCIENT_SQLITE_SINK_PATH" in os.environ:
+    SQLITE_SINK_PATH = os.environ["OMNISCIENT_SQLITE_SINK_PATH"]
+if "OMNISCIENT_WATCH_TIMEOUT" in os.environ:
+    WATCH_TIMEOUT = int(os.environ["OMNISCIENT_WATCH_TIMEOUT"])
+if "OMNISCIENT_WATCH_POLL" in os.environ:
+    WATCH_POLL = float(os.environ["OMNISCIENT_WATCH_POLL"])
+if "OMNISCIENT_WATCH_MAX" in os.environ:
+    WATCH_MAX = int(os.environ["OMNISCIENT_WATCH_MAX"])
+if "FLASK_DEBUG" in os.environ:
+    DEBUG = os.environ["FLASK_DEBUG"] in ("1", "true", "True")
+
+for name in SINKS:
+    if name not in ("influx", "file", "sqlite"):
+        raise ValueError(f"Unknown sink {name}, use influx, file or sqlite")
+
+# Sinks, writer and notifier threads don't survive a fork, so they are
+# set up per process by setup(), either from the server's worker init
+# hook or on first use.
+sinks = []
+writers = {}
+notifier = None
+process_id = None
+process_lock = threading.Lock()
+draining = False
+
+# With a threaded server every held watch ties up a thread, so only a
+# few are held per process and the rest are answered right away.
+watch_slots = threading.BoundedSemaphore(WATCH_MAX)
+
+
+def make_sink(name: str) -> Sink:
+    """
+    Create a sink by name.
+    """
+
+    if name == "influx":
+        return InfluxSink(INFLUX_HOST, INFLUX_PORT, INFLUX_DB)
+    if name == "file":
+        return FileSink(FILE_SINK_PATH, max_size=FILE_SINK_SIZE, backups=FILE_SINK_BACKUPS)
+    if name == "sqlite":
+        return SQLiteSink(SQLITE_SINK_PATH)
+
+    raise ValueError(f"Unknown sink {name}")
+
+
+def setup() -> None:
+    """
+    Set up the sinks and their write pipelines for this process. Every
+    sink gets its own writer, so a slow or failing sink doesn't hold up
+    the others.
+    """
+
+    global sinks, writers, notifier, process_id, draining
+
+    with process_lock:
+        if process_id == os.getpid():
+            return
+
+        sinks = [make_sink(name) for name in SINKS]
+        writers = {}
+
+        for sink in sinks:
+            # The first sink keeps the configured spill file to itself
+            spill_path = INFLUX_SPILL_PATH
+            if writers:
+                spill_path += "." + sink.name
+
+            writers[sink.name] = BatchWriter(
+                sink.write, batch_size=INFLUX_BATCH_SIZE, max_age=INFLUX_BATCH_AGE,
+                max_queue=INFLUX_QUEUE_SIZE, policy=INFLUX_OVERFLOW,
+                spill_path=spill_path, max_retries=INFLUX_MAX_RETRIES)
+            writers[sink.name].start()
+
+        notifier = ChangeNotifier(watch_state, interval=WATCH_POLL)
+        notifier.start()
+
+        process_id = os.getpid()
+        draining = False
+
 
-client = InfluxDBClient(host=INFLUX_HOST, port=INFLUX_PORT)
-client.switch_database(INFLUX_DB)
+def shutdown() -> None:
+    """
+    Stop accepting results and flush what is buffered.
+    """
+
+    global draining
+
+    draining = True
+
+    if process_id == os.getpid():
+        notifier.stop()
+        for writer in writers.values():
+            writer.stop()
+        for sink in sinks:
+            sink.close()
+
+
+def stop_watches() -> None:
+    """
+    Answer all held config watches within WATCH_POLL seconds and don't
+    hold any new ones, so that they don't hold up a graceful shutdown.
+    Safe to call from a signal handler.
+    """
 
+    if process_id == os.getpid():
+        notifier.stop_soon()
 
-def influx_write(result: list) -> bool:
+
+def get_writers() -> dict:
     """
-    Write data to influxdb.
+    Get the write pipelines of this process by sink name.
     """
-    if client.write_points(result):
-        return True
-    return False
+
+    if process_id != os.getpid():
+        setup()
+
+    return writers
+
+
+def get_notifier() -> ChangeNotifier:
+    """
+    Get the notifier of config changes of this process.
+    """
+
+    if process_id != os.getpid():
+        setup()
+
+    return notifier
 
 
 def get_hash(filename: str) -> str:
@@ -41,106 +204,243 @@ def get_hash(filename: str) -> str:
     Get hash of check file.
     """
 
-    with open("checks/" + filename, "rb") as fd:
-        data = fd.read()
+    return check_registry.get_hash(filename)
 
-    return hashlib.sha256(data).hexdigest()
 
-
-def get_config(filename: Optional[str] = "config.json") -> dict:
+def get_config() -> ConfigIndex:
     """
-    Get config from file.
+    Get the indexed config, re-read from file only when it has changed.
     """
 
-    try:
-        with open(filename) as fd:
-            config = json.load(fd)
-    except Exception as e:
-        print(f"Error reading config file: {e}")
-        return {}
-    return config
+    return config_cache.index()
 
 
-def get_groups(uuid: str, config: dict) -> list:
+def get_groups(uuid: str, index: ConfigIndex) -> tuple:
     """
     Get groups for uuid.
     """
 
-    found = []
-    for group in config["groups"]:
-        if uuid in config["groups"][group]:
-            found.append(group)
-        if "*" in config["groups"][group]:
-            found.append(group)
-
-    return found
+    return index.groups(uuid)
 
 
-def get_tests(uuid: str, config: dict) -> list:
+def get_tests(uuid: str, index: ConfigIndex) -> list:
     """
     Get tests for uuid.
     """
 
-    found = get_groups(uuid, config)
     tests = []
 
-    for test in config["tests"]:
-        testgroups = config["tests"][test]["groups"]
-        for group in testgroups:
-            if group in found:
-                filename = config["tests"][test]["check"]
-                filehash = get_hash(filename)
-                config["tests"][test]["hash"] = filehash
+    for test in index.tests(uuid):
+        # The indexed tests are shared between requests, don't modify them
+        testconfig = dict(test)
+        testconfig["hash"] = get_hash(testconfig["check"])
 
-                tests.append(config["tests"][test])
+        tests.append(testconfig)
 
     return tests
 
 
-def get_alias(uuid: str, config: dict) -> str:
+def get_payload(uuid: str, index: ConfigIndex) -> tuple:
     """
-    Get alias for uuid.
+    Get the serialized test list for uuid and its ETag. The result is
+    reused by every worker with the same groups until the config or one
+    of the check scripts changes.
+    """
+
+    data = get_tests(uuid, index)
+    key = (index.groups(uuid), tuple(test["hash"] for test in data))
+
+    if key in index.cache:
+        return index.cache[key]
+
+    if data:
+        body = json.dumps({"status": "ok", "data": data}, sort_keys=True)
+    else:
+        body = json.dumps({"status": "error", "message": "Unknown client"})
+
+    payload = (body, hashlib.sha256(body.encode()).hexdigest())
+    index.cache[key] = payload
+
+    return payload
+
+
+def watch_state() -> tuple:
+    """
+    Get what the answers to /config depend on, the config and the hashes
+    of the check scripts.
     """
 
-    if "clients" not in config:
-        return uuid
+    index = get_config()
+    tests = index.config.get("tests", {})
 
-    for client in config["clients"]:
-        if client != uuid:
-            continue
-        if "alias" not in config["clients"][client]:
-            return uuid
-        alias = config["clients"][client]["alias"]
+    return (index, tuple(get_hash(tests[test]["check"]) for test in tests))
 
-        if alias is None:
-            return uuid
-        if alias == "":
-            return uuid
 
-    return alias
+def get_alias(uuid: str, index: ConfigIndex) -> str:
+    """
+    Get alias for uuid.
+    """
+
+    return index.alias(uuid)
 
 
 @app.route("/config", methods=["GET"])
-def config_get() -> dict:
+def config_get() -> Response:
     """
     Get config.
     """
 
     args = request.args
-    config = get_config()
+    index = get_config()
 
-    if config == {}:
+    if index.config == {}:
         return jsonify({"status": "error", "message": "Error reading config file"}), 500
 
     if "uuid" not in args:
         return jsonify({"status": "error", "message": "Missing argument uuid"}), 400
 
-    data = get_tests(args["uuid"], config)
+    body, etag = get_payload(args["uuid"], index)
+
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+
+    return response.make_conditional(request)
 
-    if data:
-        return jsonify({"status": "ok", "data": data})
 
-    return jsonify({"status": "error", "message": "Unknown client"})
+@app.route("/config/watch", methods=["GET"])
+def config_watch_get() -> Response:
+    """
+    Long-poll for config. Answers like /config, but if the worker already
+    has the current version (If-None-Match) the request is held until the
+    config for the worker changes or the timeout passes, in which case the
+    answer is 304. Held watches wait for the notifier instead of looking
+    for changes themselves. Once WATCH_MAX watches are held by this
+    process, further ones are answered at once.
+    """
+
+    args = request.args
+
+    if "uuid" not in args:
+        return jsonify({"status": "error", "message": "Missing argument uuid"}), 400
+
+    try:
+        timeout = min(float(args.get("timeout", WATCH_TIMEOUT)), WATCH_TIMEOUT)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid timeout"}), 400
+
+    changes = get_notifier()
+    held = watch_slots.acquire(blocking=False)
+
+    if not held:
+        timeout = 0
+
+    deadline = time.monotonic() + timeout
+
+    try:
+        while True:
+            if draining:
+                return jsonify({"status": "error", "message": "Shutting down"}), 503
+
+            # Taken before the payload, so that a change while it is
+            # built isn't missed.
+            version = changes.version()
+            index = get_config()
+
+            if index.config == {}:
+                return jsonify({"status": "error",
+                                "message": "Error reading config file"}), 500
+
+            body, etag = get_payload(args["uuid"], index)
+
+            if not request.if_none_match.contains(etag):
+                break
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not changes.wait(version, remaining):
+                break
+    finally:
+        if held:
+            watch_slots.release()
+
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+
+    return response.make_conditional(request)
+
+
+@app.route("/checks/<path:filename>", methods=["GET"])
+def checks_get(filename: str) -> Response:
+    """
+    Download a check script or its signature.
+    """
+
+    if filename.endswith(".sig"):
+        artifact = check_registry.get(filename[:-len(".sig")])
+        if artifact is None or artifact.signature is None:
+            abort(404)
+        data, etag = artifact.signature, artifact.signature_hash
+    else:
+        artifact = check_registry.get(filename)
+        if artifact is None:
+            abort(404)
+        data, etag = artifact.data, artifact.hash
+
+    response = Response(data, mimetype="application/octet-stream")
+    response.set_etag(etag)
+
+    return response.make_conditional(request)
+
+
+@app.route("/bundle", methods=["GET", "POST"])
+def bundle_get() -> Response:
+    """
+    Download all check scripts a worker needs, with their signatures, as
+    one gzip compressed tar archive. Scripts whose sha256 is listed in
+    "have" of a posted JSON body are left out.
+    """
+
+    args = request.args
+    index = get_config()
+
+    if "uuid" not in args:
+        return jsonify({"status": "error", "message": "Missing argument uuid"}), 400
+
+    if not get_groups(args["uuid"], index):
+        return jsonify({"status": "error", "message": "Unknown client"}), 400
+
+    body = request.get_json(silent=True) or {}
+    have = body.get("have", []) if isinstance(body, dict) else []
+
+    if not isinstance(have, list):
+        return jsonify({"status": "error", "message": "Invalid have list"}), 400
+
+    artifacts = {}
+    for test in index.tests(args["uuid"]):
+        artifact = check_registry.get(test["check"])
+        if artifact is not None:
+            artifacts[artifact.name] = artifact
+
+    artifacts = [artifacts[name] for name in sorted(artifacts)]
+    wanted = [artifact for artifact in artifacts if artifact.hash not in have]
+
+    if len(wanted) == len(artifacts):
+        # Only the full bundle is cached, the subsets depend on what each
+        # worker already has.
+        key = ("bundle",) + tuple((a.name, a.hash, a.signature_hash) for a in artifacts)
+
+        if key not in index.cache:
+            data = bundle.build(artifacts)
+            index.cache[key] = (data, hashlib.sha256(data).hexdigest())
+
+        data, etag = index.cache[key]
+    else:
+        data = bundle.build(wanted)
+        etag = hashlib.sha256(data).hexdigest()
+
+    response = Response(data, mimetype="application/gzip")
+    response.set_etag(etag)
+
+    return response.make_conditional(request)
 
 
 @app.route("/callhome", methods=["POST"])
@@ -150,28 +450,104 @@ def callhome_post() -> dict:
     """
 
     args = request.args
-    config = get_config()
+    index = get_config()
 
     if "uuid" not in args:
         return jsonify({"status": "error", "message": ""}), 400
 
     uuid = args["uuid"]
-    alias = get_alias(uuid, config)
+    alias = get_alias(uuid, index)
 
-    if not get_groups(uuid, config):
+    if not get_groups(uuid, index):
         return jsonify({"status": "error", "message": ""}), 400
 
     results = request.get_json()
+    tags = {"uuid": uuid, "alias": alias}
+
+    try:
+        lines = encoder.encode(results, tags)
+    except (PointError, TypeError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    return write_lines(lines)
+
+
+@app.route("/callhome/bulk", methods=["POST"])
+def callhome_bulk_post() -> dict:
+    """
+    Callhome with many results at once, as JSON lines or msgpack,
+    optionally compressed with gzip or zstd.
+    """
+
+    args = request.args
+    index = get_config()
+
+    if "uuid" not in args:
+        return jsonify({"status": "error", "message": "Missing argument uuid"}), 400
+
+    uuid = args["uuid"]
+
+    if not get_groups(uuid, index):
+        return jsonify({"status": "error", "message": "Unknown client"}), 400
+
+    tags = {"uuid": uuid, "alias": get_alias(uuid, index)}
+
+    try:
+        data = decompress(request.get_data(), request.headers.get("Content-Encoding"))
+        lines = encoder.encode(decode(data, request.headers.get("Content-Type")), tags)
+    except (BulkError, PointError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    return write_lines(lines)
+
+
+def write_lines(lines: list) -> tuple:
+    """
+    Queue encoded points for writing and build the callhome response.
+    """
+
+    if draining:
+        return jsonify({"status": "error", "message": "Shutting down"}), 503
+
+    # Accepted if any sink took the points, the worker retrying would
+    # only duplicate them in the others.
+    accepted = [writer.put(lines) for writer in get_writers().values()]
+
+    if any(accepted):
+        return jsonify({"status": "ok", "points": len(lines)}), 202
+
+    return jsonify({"status": "error", "message": "Write buffer full"}), 503
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_get() -> dict:
+    """
+    Get write pipeline metrics of every sink.
+    """
+
+    return jsonify({"sinks": {name: writer.metrics()
+                              for name, writer in get_writers().items()}})
+
+
+@app.route("/health", methods=["GET"])
+def health_get() -> dict:
+    """
+    Health check for load balancers. Fails while the process is draining
+    or when the config couldn't be loaded.
+    """
+
+    if draining:
+        return jsonify({"status": "draining"}), 503
 
-    for result in results:
-        result["tags"]["uuid"] = uuid
-        result["tags"]["alias"] = alias
+    if get_config().config == {}:
+        return jsonify({"status": "error", "message": "No valid config"}), 503
 
-    if influx_write(results):
-        return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", "pid": os.getpid(),
+                    "queue_depth": sum(writer.depth()
+                                       for writer in get_writers().values())})
 
-    return jsonify({"status": "error"}, 400)
 
+atexit.register(shutdown)
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=8080)
+    app.run(debug=DEBUG, host="0.0.0.0", port=8080, threaded=True)
@@ -0,0 +1,228 @@
+import math
+import threading
+import time
+from typing import Callable, Optional
+
+from omniscient.log import get_logger
+
+log = get_logger()
+
+STATS = ("count", "min", "max", "mean", "sum", "last", "p50", "p90", "p95", "p99")
+DEFAULT_STATS = ["count", "min", "max", "mean"]
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Nearest rank percentile of sorted values.
+    """
+
+    rank = max(math.ceil(pct / 100 * len(values)), 1)
+
+    return values[rank - 1]
+
+
+def summarize(samples: list, stats: list) -> dict:
+    """
+    Summarize the fields of a window of samples. Numbers get one field
+    per statistic, named <field>_<stat>, booleans the share of samples
+    they were true in as <field>_ratio, and strings their last value.
+    A sample without a boolean field counts as false for it, checks only
+    report flags such as timeout when they are set.
+    """
+
+    numbers = {}
+    flags = {}
+    strings = {}
+
+    for fields in samples:
+        for key, value in fields.items():
+            if isinstance(value, bool):
+                flags.setdefault(key, []).append(value)
+            elif isinstance(value, (int, float)):
+                if not (isinstance(value, float) and math.isnan(value)):
+                    numbers.setdefault(key, []).append(value)
+            else:
+                strings[key] = value
+
+    summary = {"samples": len(samples)}
+
+    for key, values in numbers.items():
+        ordered = sorted(values)
+        for stat in stats:
+            if stat == "count":
+                summary[f"{key}_count"] = len(values)
+            elif stat == "min":
+                summary[f"{key}_min"] = ordered[0]
+            elif stat == "max":
+                summary[f"{key}_max"] = ordered[-1]
+            elif stat == "mean":
+                summary[f"{key}_mean"] = sum(values) / len(values)
+            elif stat == "sum":
+                summary[f"{key}_sum"] = sum(values)
+            elif stat == "last":
+                summary[f"{key}_last"] = values[-1]
+            elif stat.startswith("p"):
+                summary[f"{key}_{stat}"] = percentile(ordered, float(stat[1:]))
+
+    for key, values in flags.items():
+        summary[f"{key}_ratio"] = sum(values) / len(samples)
+
+    summary.update(strings)
+
+    return summary
+
+
+class Aggregator(object):
+    def __init__(self, emit: Callable, interval: Optional[float] = 1.0) -> None:
+        """
+        Reduce the results of tests configured for it before they are
+        sent to the master. In "summary" mode the samples of each window
+        seconds are replaced by one point summarizing them, in "change"
+        mode a sample is only sent if its fields differ from the last one
+        sent or heartbeat seconds have passed. Points of other tests pass
+        through. Finished windows are handed to emit every interval
+        seconds.
+        """
+
+        self.emit = emit
+        self.interval = interval
+
+        self.__lock = threading.Lock()
+        self.__configs = {}
+        self.__windows = {}
+        self.__last = {}
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def configure(self, measurement: str, config: Optional[dict]) -> None:
+        """
+        Set the aggregation of a measurement, None to send every sample.
+        Samples buffered under a previous configuration are sent first.
+        """
+
+        with self.__lock:
+            if self.__configs.get(measurement) == config:
+                return
+
+            pending = self.__flush(lambda key: key[0] == measurement)
+
+            if config:
+                self.__configs[measurement] = config
+            else:
+                self.__configs.pop(measurement, None)
+
+            for key in [key for key in self.__last if key[0] == measurement]:
+                del self.__last[key]
+
+        if pending:
+            self.emit(pending)
+
+    def add(self, points: list) -> list:
+        """
+        Take in new points, returning the ones to send right away.
+        """
+
+        now = time.time()
+        send = []
+
+        with self.__lock:
+            for point in points:
+                measurement = point["measurement"]
+                config = self.__configs.get(measurement)
+
+                if config is None:
+                    send.append(point)
+                    continue
+
+                key = (measurement, tuple(sorted(point.get("tags", {}).items())))
+
+                if config.get("mode", "summary") == "change":
+                    last = self.__last.get(key)
+                    heartbeat = config.get("heartbeat", 0)
+
+                    if (last is None or last[1] != point["fields"] or
+                            (heartbeat and now - last[0] >= heartbeat)):
+                        self.__last[key] = (now, point["fields"])
+                        send.append(point)
+                    continue
+
+                window = config.get("window", 60)
+                start = now - now % window
+                current = self.__windows.get(key)
+
+                if current is not None and current[0] != start:
+                    send.append(self.__summary(key, current))
+                    current = None
+
+                if current is None:
+                    current = self.__windows[key] = (start, point.get("tags", {}), [])
+
+                current[2].append(point["fields"])
+
+        return send
+
+    def __summary(self, key: tuple, window: tuple) -> dict:
+        config = self.__configs.get(key[0], {})
+        start, tags, samples = window
+
+        return {
+            "measurement": key[0],
+            "tags": dict(tags),
+            "fields": summarize(samples, config.get("stats", DEFAULT_STATS)),
+            "time": int(start * 1e9),
+        }
+
+    def __flush(self, match: Callable) -> list:
+        points = []
+
+        for key in [key for key in self.__windows if match(key)]:
+            points.append(self.__summary(key, self.__windows.pop(key)))
+
+        return points
+
+    def flush(self, force: Optional[bool] = False) -> list:
+        """
+        Get the summaries of all finished windows, or of all windows if
+        force is set.
+        """
+
+        now = time.time()
+
+        def finished(key: tuple) -> bool:
+            window = self.__configs.get(key[0], {}).get("window", 60)
+            return force or self.__windows[key][0] + window <= now
+
+        with self.__lock:
+            return self.__flush(finished)
+
+    def __run(self) -> None:
+        while not self.__stop.wait(self.interval):
+            points = self.flush()
+            if points:
+                self.emit(points)
+
+    def start(self) -> None:
+        """
+        Start sending finished windows.
+        """
+
+        if self.__thread and self.__thread.is_alive():
+            return
+
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, name="aggregator", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the aggregator, sending what has been collected so far.
+        """
+
+        self.__stop.set()
+
+        if self.__thread:
+            self.__thread.join()
+
+        points = self.flush(force=True)
+        if points:
+            self.emit(points)
@@ -0,0 +1,88 @@
+import io
+import json
+import zlib
+from typing import Iterator, Optional
+
+import msgpack
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+
+class BulkError(Exception):
+    pass
+
+
+def decompress(body: bytes, encoding: Optional[str] = None,
+               limit: Optional[int] = MAX_BODY_SIZE) -> bytes:
+    """
+    Decompress a request body according to its Content-Encoding, refusing
+    to inflate it beyond limit bytes.
+    """
+
+    encoding = (encoding or "identity").strip().lower()
+
+    if encoding == "identity":
+        data = body
+    elif encoding in ("gzip", "x-gzip", "deflate"):
+        wbits = 16 + zlib.MAX_WBITS if encoding != "deflate" else zlib.MAX_WBITS
+        decompressor = zlib.decompressobj(wbits)
+        try:
+            data = decompressor.decompress(body, limit + 1)
+        except zlib.error as e:
+            raise BulkError(f"Invalid {encoding} data: {e}")
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise BulkError("zstd encoding not supported, zstandard is not installed")
+        try:
+            reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body))
+            data = reader.read(limit + 1)
+        except zstandard.ZstdError as e:
+            raise BulkError(f"Invalid zstd data: {e}")
+    else:
+        raise BulkError(f"Unsupported content encoding {encoding}")
+
+    if len(data) > limit:
+        raise BulkError(f"Body larger than {limit} bytes")
+
+    return data
+
+
+def decode(data: bytes, content_type: Optional[str] = None) -> Iterator[dict]:
+    """
+    Iterate over the records of a bulk body, either JSON lines or a
+    stream of msgpack maps. A JSON or msgpack list of records is accepted
+    as well.
+    """
+
+    content_type = (content_type or "application/x-ndjson").split(";")[0].strip().lower()
+
+    if content_type in ("application/msgpack", "application/x-msgpack"):
+        unpacker = msgpack.Unpacker(io.BytesIO(data), raw=False)
+        try:
+            for record in unpacker:
+                if isinstance(record, list):
+                    yield from record
+                else:
+                    yield record
+        except (msgpack.UnpackException, ValueError) as e:
+            raise BulkError(f"Invalid msgpack data: {e}")
+    elif content_type in ("application/x-ndjson", "application/jsonl",
+                          "application/json-lines", "application/json"):
+        for num, line in enumerate(data.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise BulkError(f"Invalid JSON on line {num}: {e}")
+            if isinstance(record, list):
+                yield from record
+            else:
+                yield record
+    else:
+        raise BulkError(f"Unsupported content type {content_type}")
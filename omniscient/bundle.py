@@ -0,0 +1,139 @@
+import hashlib
+import io
+import os
+import tarfile
+from typing import Optional
+
+import requests
+
+from omniscient.log import get_logger
+from omniscient.signher import ssl_verify
+from omniscient.store import ScriptStore
+
+log = get_logger()
+
+MAX_BUNDLE_SIZE = 64 * 1024 * 1024
+
+
+class BundleError(Exception):
+    pass
+
+
+def build(artifacts: list) -> bytes:
+    """
+    Pack check scripts and their signatures into a gzip compressed tar
+    archive. The archive only depends on the content of the artifacts.
+    """
+
+    buf = io.BytesIO()
+
+    with tarfile.open(fileobj=buf, mode="w:gz", compresslevel=6) as tar:
+        for artifact in artifacts:
+            files = [(artifact.name, artifact.data, 0o755)]
+            if artifact.signature is not None:
+                files.append((artifact.name + ".sig", artifact.signature, 0o644))
+
+            for name, data, mode in files:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = mode
+                tar.addfile(info, io.BytesIO(data))
+
+    return buf.getvalue()
+
+
+def extract(data: bytes, limit: Optional[int] = MAX_BUNDLE_SIZE) -> dict:
+    """
+    Unpack a bundle into a mapping of script name to (data, signature)
+    without touching the disk. Anything but plain files with plain names
+    is refused.
+    """
+
+    files = {}
+    total = 0
+
+    try:
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+            for member in tar:
+                name = member.name
+
+                if (not member.isfile() or name != os.path.basename(name)
+                        or name.startswith(".")):
+                    raise BundleError(f"Refusing bundle member {name}")
+
+                total += member.size
+                if total > limit:
+                    raise BundleError(f"Bundle larger than {limit} bytes")
+
+                files[name] = tar.extractfile(member).read()
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise BundleError(f"Invalid bundle: {e}")
+
+    return {name: (content, files.get(name + ".sig"))
+            for name, content in files.items() if not name.endswith(".sig")}
+
+
+def install(url: str, uuid: str, tests: list, store: ScriptStore,
+            manifest: Optional[object] = None,
+            session: Optional[requests.Session] = None,
+            cert_path: Optional[str] = "certs/public.cert") -> int:
+    """
+    Fetch every check script of tests that is missing from the store in
+    a single request, verify them and store them. Returns the number of
+    scripts stored. Scripts that can't be installed here are left for
+    the check to download on its own.
+    """
+
+    wanted = {test["check"]: test.get("hash") for test in tests}
+    have = {rhash for rhash in wanted.values() if rhash and store.has(rhash)}
+
+    if all(rhash in have for rhash in wanted.values() if rhash):
+        return 0
+
+    session = session or requests.Session()
+
+    try:
+        res = session.post(url + "/bundle", params={"uuid": uuid},
+                           json={"have": sorted(have)}, timeout=60)
+    except requests.exceptions.RequestException as e:
+        log.error(f"Failed to download check bundle from {url}: {e}")
+        return 0
+
+    if res.status_code != 200:
+        log.debug(f"No check bundle from {url} ({res.status_code})")
+        return 0
+
+    try:
+        files = extract(res.content)
+    except BundleError as e:
+        log.error(f"Failed to unpack check bundle: {e}")
+        return 0
+
+    installed = 0
+
+    for name, (data, signature) in files.items():
+        digest = hashlib.sha256(data).hexdigest()
+
+        if wanted.get(name) != digest:
+            log.error(f"Bundled check {name} doesn't match remote hash")
+            continue
+
+        try:
+            covered = manifest is not None and manifest.covers(name, digest)
+
+            if not covered:
+                if signature is None or not ssl_verify(data, signature.decode(), cert_path):
+                    log.error(f"Bundled check {name} not signed")
+                    continue
+
+            store.put(data, signature)
+        except (ValueError, OSError) as e:
+            # Left for the check to download and verify on its own
+            log.error(f"Failed to install check {name}: {e}")
+            continue
+
+        installed += 1
+
+    log.info(f"Installed {installed} checks from bundle")
+
+    return installed
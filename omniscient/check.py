@@ -1,13 +1,21 @@
+import asyncio
 import hashlib
 import os
-import stat
+import resource
+import signal
 import subprocess
+import threading
 import time
+from typing import Optional
 
 import requests
 
+from omniscient import plugin, result
+from omniscient.coalesce import Coalescer
 from omniscient.log import get_logger
-from omniscient.signher import ssl_verify, verify_file
+from omniscient.manifest import Manifest
+from omniscient.signher import verify_file
+from omniscient.store import ScriptStore
 
 log = get_logger()
 
@@ -16,95 +24,161 @@ class CheckError(Exception):
     pass
 
 
+class CheckTimeout(CheckError):
+    pass
+
+
 class Check():
-    def __init__(self, config: dict) -> None:
+    def __init__(self, config: dict, manifest: Optional[Manifest] = None,
+                 store: Optional[ScriptStore] = None,
+                 coalescer: Optional[Coalescer] = None) -> None:
+        self.__manifest = manifest
+        self.__coalescer = coalescer
+        self.__store = store if store is not None else ScriptStore()
+        self.__config = {}
+        self.__hash = None
+        self.__lock = threading.Lock()
+        self.__prepared = False
+        self.__process = []
+        self.__module = None
+
+        self.update(config)
+
+    def update(self, config: dict) -> None:
+        """
+        Apply a new test configuration. The script is only downloaded and
+        verified again if the check or its remote hash changed.
+        """
+
+        if (config["check"] != self.__config.get("check") or
+                config.get("hash") != self.__config.get("hash")):
+            self.__prepared = False
+
+        rhash = config.get("hash")
+        if rhash != self.__hash:
+            if self.__hash is not None:
+                self.__store.release(self.__hash)
+            if rhash is not None:
+                self.__store.acquire(rhash)
+            self.__hash = rhash
+
         self.__config = config
         self.__name = config["name"]
         self.__retries = config["retries"]
-        self.__scripts_path = "/tmp/scripts/"
-        self.__signed = False
+        self.__timeout = config.get("timeout") or config["interval"] or None
+        self.__limits = config.get("limits", {})
+        self.__filename = self.__store.filename(rhash) if rhash else None
 
-        download = False
+        # Python checks are plugins run in the worker itself
+        self.__native = config["check"].endswith(".py")
 
-        if not os.path.exists(self.__scripts_path):
-            log.debug("Scripts directory missing, creating")
-            os.mkdir(self.__scripts_path)
+        self.__process = [self.__filename]
+        if self.__native:
+            self.__process.extend(config["args"].split())
         else:
-            log.debug("Scripts directory exists")
+            self.__process.extend(config["args"].split(" "))
+
+    def close(self) -> None:
+        """
+        Let go of the script, so that the store can remove it once no
+        other check uses it.
+        """
+
+        if self.__hash is not None:
+            self.__store.release(self.__hash)
+            self.__hash = None
+
+    def __prepare(self) -> bool:
+        """
+        Make sure the script is in the store and signed, downloading it
+        if needed.
+        """
 
-        self.__filename = self.__scripts_path + config["check"]
+        rhash = self.__get_remote_hash()
+
+        if rhash is None:
+            log.error(f"Check {self.__config['check']} not available on the server")
+            return False
 
         log.debug(f"Check filename: {self.__filename}")
 
-        self.__rhash = self.__get_remote_hash()
-        self.__lhash = self.__get_hash()
+        if not self.__store.has(rhash) or not self.__verify():
+            log.info(f"Check {self.__config['check']} with hash {rhash} not in store")
 
-        if self.__lhash != self.__rhash:
-            log.info("File hash differ:")
-            log.info(f"   local={self.__lhash}")
-            log.info(f"   remote={self.__rhash}")
+            if not self.__fetch(rhash):
+                return False
 
-            download = True
+            if not self.__verify():
+                log.error("File " + self.__filename + " not signed")
+                return False
 
-        try:
-            if verify_file(self.__filename, self.__filename + ".sig", "certs/public.cert"):
-                log.info("File signature of " + self.__filename + " verified")
-                self.__signed = True
-        except Exception as e:
-            log.error("Failed to verify file signature: " + e)
-            self.__signed = False
+        log.info("File signature of " + self.__filename + " verified")
 
-        if not self.__signed:
-            log.info("File not signed")
-            download = True
+        if self.__native:
+            try:
+                self.__module = plugin.load(self.__filename, rhash)
+            except plugin.PluginError as e:
+                log.error(str(e))
+                return False
 
-        if download:
-            if self.__download():
-                log.info("Downloaded new check")
-            else:
-                log.info("Failed to download new check")
-                self.__filename = None
-                self.__process = None
+        return True
 
-        if self.__filename is not None:
-            self.__process = [self.__filename]
-        else:
-            self.__process = []
+    def __fetch(self, rhash: str) -> bool:
+        """
+        Download the script into the store.
+        """
 
-        self.__process.extend(config["args"].split(" "))
+        if not self.__download(rhash):
+            log.info("Failed to download new check")
+            return False
 
-        if self.__process and self.__process != [] and self.__process != [''] and self.__signed:
-            self.result = self.__start()
-        else:
-            log.error(f"Check {self.__name} not started")
+        log.info("Downloaded new check")
 
-    def __get_remote_hash(self) -> str:
+        return True
+
+    def __in_manifest(self) -> bool:
         """
-        Get the hash of the remote check script.
+        Check if the remote hash is listed in the verified manifest.
         """
 
-        return self.__config["hash"]
+        if self.__manifest is None:
+            return False
 
-    def __get_hash(self) -> str:
+        return self.__manifest.covers(self.__config["check"], self.__get_remote_hash())
+
+    def __verify(self) -> bool:
         """
-        Get the hash of the local check script.
+        Verify the signature of the stored script, either through the
+        manifest or its own .sig file.
         """
 
-        if not os.path.exists(self.__filename):
-            return None
-        with open(self.__filename, "rb") as fd:
-            return hashlib.sha256(fd.read()).hexdigest()
+        # The store only holds scripts under their own hash
+        if self.__in_manifest():
+            return True
 
-    def __download(self) -> bool:
+        try:
+            return bool(verify_file(self.__filename, self.__filename + ".sig",
+                                    "certs/public.cert"))
+        except Exception as e:
+            log.error(f"Failed to verify file signature: {e}")
+            return False
+
+    def __get_remote_hash(self) -> str:
         """
-        Download the check script from the server.
+        Get the hash of the remote check script.
         """
 
-        check = [self.__config["check"]][0]
-        filename = self.__scripts_path + check
+        return self.__config.get("hash")
+
+    def __download(self, rhash: str) -> bool:
+        """
+        Download the check script from the server into the store.
+        """
+
+        check = self.__config["check"]
         downloadurl = self.__config["url"] + "/checks/" + check
 
-        log.info(f"Downloading script {filename} from {downloadurl}")
+        log.info(f"Downloading script {check} from {downloadurl}")
         try:
             res = requests.get(downloadurl)
 
@@ -113,31 +187,143 @@ class Check():
                 return False
 
             file_content = res.content
+            signature_content = None
 
-            res = requests.get(downloadurl + ".sig")
-
-            if res.status_code != 200:
-                log.error(
-                    "Failed to download check signature from " + downloadurl + ".sig")
+            if hashlib.sha256(file_content).hexdigest() != rhash:
+                log.error(f"Downloaded check {check} doesn't match remote hash")
                 return False
 
-            signature_content = res.content
+            # Scripts in the manifest don't need their own signature
+            if not self.__in_manifest():
+                res = requests.get(downloadurl + ".sig")
 
-            with open(filename, "wb") as fd:
-                fd.write(file_content)
+                if res.status_code != 200:
+                    log.error(
+                        "Failed to download check signature from " + downloadurl + ".sig")
+                    return False
 
-            with open(filename + ".sig", "wb") as fd:
-                fd.write(signature_content)
+                signature_content = res.content
 
-            os.chmod(filename, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+            self.__store.put(file_content, signature_content)
         except requests.exceptions.ConnectionError:
             log.error("Failed to download check from " + downloadurl)
+            return False
         except Exception as e:
-            log.error("Failed to write new check: " + e)
+            log.error(f"Failed to write new check: {e}")
+            return False
 
         return True
 
-    def __start(self) -> str:
+    def __ensure_prepared(self) -> None:
+        """
+        Prepare the script unless already done, raising CheckError if it
+        can't be prepared.
+        """
+
+        if not self.__prepared:
+            with self.__lock:
+                if not self.__prepared:
+                    self.__prepared = self.__prepare()
+
+        if not self.__prepared:
+            raise CheckError(f"Check {self.__name} not started")
+
+    def run(self) -> object:
+        """
+        Run the check and return its output, or the fields returned by a
+        plugin. The script is prepared on the first run and after a
+        change of remote hash only.
+        """
+
+        self.__ensure_prepared()
+
+        start = self.__start_native if self.__native else self.__start
+
+        if self.__coalescer is None:
+            return start()
+
+        return self.__coalescer.run(self.__run_key(), start, self)
+
+    async def arun(self) -> object:
+        """
+        Run the check from an event loop and return its output, or the
+        fields returned by a plugin. Preparation, which may download the
+        script, and plugins run in the loop's default executor.
+        """
+
+        if not self.__prepared:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.__ensure_prepared)
+
+        start = self.__astart_native if self.__native else self.__astart
+
+        if self.__coalescer is None:
+            return await start()
+
+        return await self.__coalescer.arun(self.__run_key(), start, self)
+
+    def __run_key(self) -> tuple:
+        """
+        Get what identifies an execution of the check, shared by all
+        checks that would run exactly the same process.
+        """
+
+        return (self.__hash, tuple(self.__process[1:]), self.__timeout,
+                tuple(sorted(self.__limits.items())), self.__retries)
+
+    def __set_limits(self, pid: int) -> None:
+        """
+        Apply the configured resource limits to a started check process.
+        The limits are set from the outside with prlimit since preexec_fn
+        isn't safe to use from a threaded worker.
+        """
+
+        try:
+            if "cpu" in self.__limits:
+                cpu = self.__limits["cpu"]
+                resource.prlimit(pid, resource.RLIMIT_CPU, (cpu, cpu))
+            if "memory" in self.__limits:
+                memory = self.__limits["memory"] * 1024 * 1024
+                resource.prlimit(pid, resource.RLIMIT_AS, (memory, memory))
+        except (OSError, ValueError) as e:
+            log.error(f"Failed to set resource limits on check {self.__name}: {e}")
+
+    def __kill(self, pid: int) -> None:
+        """
+        Kill the check process and everything it started.
+        """
+
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def __timed_out(self) -> CheckTimeout:
+        """
+        Log and return the error for a check that ran out of time.
+        """
+
+        log.error(f"Check {self.__name} timed out after {self.__timeout} seconds")
+
+        return CheckTimeout(f"Check {self.__name} timed out after {self.__timeout} seconds")
+
+    def __remaining(self, deadline: float) -> float:
+        """
+        Get the time left of the execution budget, raising CheckTimeout if
+        it is used up.
+        """
+
+        if deadline is None:
+            return None
+
+        remaining = deadline - time.monotonic()
+
+        if remaining <= 0:
+            raise self.__timed_out()
+
+        return remaining
+
+    def __start(self) -> bytes:
         """
         Start the check process and return the result.
         """
@@ -145,20 +331,124 @@ class Check():
         if self.__process == [] or self.__process == [''] or self.__process is None:
             raise CheckError("No process to run!")
 
-        fail = True
-        for retry in range(self.__retries):
+        deadline = None
+        if self.__timeout:
+            deadline = time.monotonic() + self.__timeout
+
+        retries = max(self.__retries, 1)
+
+        for retry in range(retries):
             log.debug(f"Starting check {self.__name} (retry {retry})")
-            res = subprocess.run(
-                self.__process, shell=False, capture_output=True)
-            if res.returncode == 0:
-                fail = False
-                break
-            time.sleep(3)
-
-        if fail:
-            log.error(
-                f"Check {self.__name} failed after {self.__retries} retries: {res.stdout}, {res.stderr}")
-            raise CheckError(
-                f"Check {self.__name} failed after {self.__retries} retries: {res.stdout}, {res.stderr}")
-
-        return res.stdout
+            timeout = self.__remaining(deadline)
+            proc = subprocess.Popen(
+                self.__process, shell=False, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, start_new_session=True)
+            self.__set_limits(proc.pid)
+
+            try:
+                stdout, stderr = proc.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.__kill(proc.pid)
+                proc.communicate()
+                raise self.__timed_out()
+
+            if proc.returncode == 0:
+                return stdout
+
+            if retry < retries - 1:
+                time.sleep(min(3, self.__remaining(deadline) or 3))
+
+        log.error(
+            f"Check {self.__name} failed after {self.__retries} retries: {stdout}, {stderr}")
+        raise CheckError(
+            f"Check {self.__name} failed after {self.__retries} retries: {stdout}, {stderr}")
+
+    async def __astart(self) -> bytes:
+        """
+        Start the check process without blocking the event loop and
+        return the result.
+        """
+
+        if self.__process == [] or self.__process == [''] or self.__process is None:
+            raise CheckError("No process to run!")
+
+        deadline = None
+        if self.__timeout:
+            deadline = time.monotonic() + self.__timeout
+
+        retries = max(self.__retries, 1)
+
+        for retry in range(retries):
+            log.debug(f"Starting check {self.__name} (retry {retry})")
+            timeout = self.__remaining(deadline)
+            proc = await asyncio.create_subprocess_exec(
+                *self.__process, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE, start_new_session=True)
+            self.__set_limits(proc.pid)
+
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                self.__kill(proc.pid)
+                await proc.wait()
+                raise self.__timed_out()
+            except asyncio.CancelledError:
+                self.__kill(proc.pid)
+                await proc.wait()
+                raise
+
+            if proc.returncode == 0:
+                return stdout
+
+            if retry < retries - 1:
+                await asyncio.sleep(min(3, self.__remaining(deadline) or 3))
+
+        log.error(
+            f"Check {self.__name} failed after {self.__retries} retries: {stdout}, {stderr}")
+        raise CheckError(
+            f"Check {self.__name} failed after {self.__retries} retries: {stdout}, {stderr}")
+
+    def __start_native(self) -> dict:
+        """
+        Run the check plugin and return its fields. A plugin can't be
+        stopped from the outside, it gets the time left as its timeout
+        and is expected to respect it. Resource limits don't apply.
+        """
+
+        deadline = None
+        if self.__timeout:
+            deadline = time.monotonic() + self.__timeout
+
+        retries = max(self.__retries, 1)
+
+        for retry in range(retries):
+            log.debug(f"Starting check {self.__name} (retry {retry})")
+            timeout = self.__remaining(deadline)
+
+            try:
+                fields = result.fields(self.__module.check(self.__process[1:], timeout))
+            except Exception as e:
+                error = e
+            else:
+                self.__remaining(deadline)
+                return fields
+
+            if retry < retries - 1:
+                time.sleep(min(3, self.__remaining(deadline) or 3))
+
+        log.error(f"Check {self.__name} failed after {self.__retries} retries: {error}")
+        raise CheckError(f"Check {self.__name} failed after {self.__retries} retries: {error}")
+
+    async def __astart_native(self) -> dict:
+        """
+        Run the check plugin in the loop's default executor and return
+        its fields.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(None, self.__start_native), self.__timeout)
+        except asyncio.TimeoutError:
+            raise self.__timed_out()
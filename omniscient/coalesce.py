@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Optional
+
+from omniscient.log import get_logger
+
+log = get_logger()
+
+
+class Run(object):
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.future = None
+        self.result = None
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+        self.callers = set()
+
+
+class Coalescer(object):
+    def __init__(self, window: Optional[float] = 1.0) -> None:
+        """
+        Share executions between callers asking for the same key. A
+        caller arriving while a run for its key is in progress, or up to
+        window seconds after it started, gets that run's result instead
+        of starting another one. A caller is never given the same run
+        twice, so a check due again soon after its last run gets a fresh
+        result.
+        """
+
+        self.window = window
+
+        self.__lock = threading.Lock()
+        self.__runs = {}
+        self.__shared = 0
+
+    def __join(self, key: tuple, caller: object,
+               loop: Optional[asyncio.AbstractEventLoop] = None) -> tuple:
+        """
+        Get the run to wait for and whether the caller has to do it.
+        """
+
+        now = time.monotonic()
+
+        with self.__lock:
+            run = self.__runs.get(key)
+
+            if (run is not None and caller not in run.callers and
+                    (run.finished is None or now - run.started <= self.window)):
+                run.callers.add(caller)
+                self.__shared += 1
+                return run, False
+
+            run = Run()
+            run.callers.add(caller)
+            if loop is not None:
+                run.future = loop.create_future()
+            self.__runs[key] = run
+
+        return run, True
+
+    def run(self, key: tuple, func: Callable, caller: object) -> object:
+        """
+        Call func, or share the result of a call made for the same key
+        by another caller.
+        """
+
+        run, owner = self.__join(key, caller)
+
+        if owner:
+            try:
+                run.result = func()
+            except Exception as e:
+                run.error = e
+            finally:
+                run.finished = time.monotonic()
+                run.done.set()
+        else:
+            log.debug(f"Sharing run of {key}")
+            run.done.wait()
+
+        if run.error is not None:
+            raise run.error
+
+        return run.result
+
+    async def arun(self, key: tuple, func: Callable, caller: object) -> object:
+        """
+        Await func(), or share the result of a call made for the same
+        key by another caller. Only to be used from a single event loop.
+        """
+
+        run, owner = self.__join(key, caller, asyncio.get_running_loop())
+
+        if not owner:
+            log.debug(f"Sharing run of {key}")
+            return await asyncio.shield(run.future)
+
+        try:
+            run.future.set_result(await func())
+        except asyncio.CancelledError:
+            run.future.cancel()
+            raise
+        except Exception as e:
+            run.future.set_exception(e)
+        finally:
+            run.finished = time.monotonic()
+
+        return run.future.result()
+
+    def shared(self) -> int:
+        """
+        Number of calls that were served by another call's run.
+        """
+
+        return self.__shared
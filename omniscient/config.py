@@ -0,0 +1,174 @@
+import json
+import threading
+from typing import Optional
+
+from omniscient.filestat import StatCache
+from omniscient.log import get_logger
+from omniscient.validate import config_errors
+
+log = get_logger()
+
+
+class ConfigIndex(object):
+    def __init__(self, config: dict) -> None:
+        self.config = config
+
+        groups = config.get("groups", {})
+        tests = config.get("tests", {})
+        clients = config.get("clients", {})
+
+        # uuid -> groups it is a member of, in config order, with the
+        # wildcard groups merged in.
+        members = {}
+        wildcard = []
+
+        for group in groups:
+            if "*" in groups[group]:
+                wildcard.append(group)
+            for uuid in groups[group]:
+                if uuid != "*":
+                    members.setdefault(uuid, set()).add(group)
+
+        self.__wildcard = tuple(wildcard)
+        self.__groups = {}
+
+        for uuid in members:
+            self.__groups[uuid] = tuple(
+                group for group in groups
+                if group in members[uuid] or group in wildcard)
+
+        # group -> names of the tests run by that group
+        self.__group_tests = {}
+
+        for test in tests:
+            for group in tests[test]["groups"]:
+                self.__group_tests.setdefault(group, []).append(test)
+
+        self.__aliases = {}
+
+        for uuid in clients:
+            alias = clients[uuid].get("alias")
+            if alias:
+                self.__aliases[uuid] = alias
+
+        # resolved groups -> tests, filled in lazily as workers call in
+        self.__tests = {}
+
+        # Data derived from this config by the caller, such as serialized
+        # responses. It is thrown away together with the index on reload.
+        self.cache = {}
+
+    def groups(self, uuid: str) -> tuple:
+        """
+        Get groups for uuid.
+        """
+
+        return self.__groups.get(uuid, self.__wildcard)
+
+    def tests(self, uuid: str) -> list:
+        """
+        Get tests for uuid. The returned list is shared between all
+        workers in the same groups and must not be modified.
+        """
+
+        groups = self.groups(uuid)
+
+        if groups in self.__tests:
+            return self.__tests[groups]
+
+        names = set()
+        for group in groups:
+            names.update(self.__group_tests.get(group, []))
+
+        tests = [self.config["tests"][test]
+                 for test in self.config.get("tests", {}) if test in names]
+        self.__tests[groups] = tests
+
+        return tests
+
+    def alias(self, uuid: str) -> str:
+        """
+        Get alias for uuid.
+        """
+
+        return self.__aliases.get(uuid, uuid)
+
+
+class ConfigCache(object):
+    def __init__(self, filename: Optional[str] = "config.json",
+                 schema: Optional[str] = "config-schema.json",
+                 check_interval: Optional[float] = 1.0) -> None:
+        self.filename = filename
+        self.schema = schema
+        self.check_interval = check_interval
+
+        self.__lock = threading.Lock()
+        self.__index = ConfigIndex({})
+        self.__stats = StatCache(check_interval)
+        # Never equal to a stat, not even to None for a missing file
+        self.__stat = ()
+
+    def __load(self) -> None:
+        """
+        Parse and validate the config file, swapping it in only if valid.
+        """
+
+        try:
+            with open(self.filename) as fd:
+                config = json.load(fd)
+        except Exception as e:
+            log.error(f"Error reading config file: {e}")
+            return
+
+        errors = config_errors(config, self.schema)
+
+        if errors:
+            for error in errors:
+                log.error(f"Config {self.filename} rejected: {error}")
+            if self.__index.config:
+                log.error("Keeping last good configuration")
+            return
+
+        log.info(f"Loaded configuration from {self.filename}")
+        self.__index = ConfigIndex(config)
+
+    def reload(self, force: Optional[bool] = False) -> bool:
+        """
+        Reload the config if the file changed on disk. Returns True if
+        the file was re-read.
+        """
+
+        with self.__lock:
+            stat = self.__stats.stat(self.filename, force)
+
+            if stat == self.__stat and not force:
+                return False
+
+            # Remember the stat even when the load fails so a broken
+            # file is not re-parsed on every request.
+            self.__stat = stat
+
+            if stat is None:
+                log.error(f"Error reading config file {self.filename}")
+                return False
+
+            self.__load()
+
+        return True
+
+    def index(self) -> ConfigIndex:
+        """
+        Get the index of the last good config, reloading it first if
+        needed. The config itself is available as index.config.
+        """
+
+        self.reload()
+
+        return self.__index
+
+    def get(self) -> dict:
+        """
+        Get the last good config, reloading it first if needed.
+        """
+
+        return self.index().config
@@ -0,0 +1,61 @@
+import os
+import threading
+import time
+from typing import Optional
+
+
+def file_stat(filename: str) -> Optional[tuple]:
+    """
+    Get the (mtime, size, inode) of a file, None if it can't be read.
+    Files are taken to be unchanged as long as these are the same.
+    """
+
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class StatCache(object):
+    def __init__(self, check_interval: Optional[float] = 1.0) -> None:
+        """
+        Stat of files, looking at each of them on disk at most once every
+        check_interval seconds so that cached contents can be checked
+        for changes on every use.
+        """
+
+        self.check_interval = check_interval
+
+        self.__lock = threading.Lock()
+        self.__stats = {}
+
+    def stat(self, filename: str, force: Optional[bool] = False) -> Optional[tuple]:
+        """
+        Get file_stat() of a file as it was at most check_interval seconds
+        ago, or as it is now if force is set.
+        """
+
+        now = time.monotonic()
+
+        with self.__lock:
+            entry = self.__stats.get(filename)
+
+        if entry is not None and not force and now - entry[0] < self.check_interval:
+            return entry[1]
+
+        stat = file_stat(filename)
+
+        with self.__lock:
+            self.__stats[filename] = (now, stat)
+
+        return stat
+
+    def forget(self, filename: str) -> None:
+        """
+        Drop what is known about a file.
+        """
+
+        with self.__lock:
+            self.__stats.pop(filename, None)
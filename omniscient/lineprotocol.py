@@ -0,0 +1,222 @@
+import math
+from typing import Callable, Optional
+
+# Range of integer fields in line protocol
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+
+class PointError(Exception):
+    pass
+
+
+def escape_measurement(name: str) -> str:
+    """
+    Escape a measurement name.
+    """
+
+    return name.replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ")
+
+
+def escape_key(key: str) -> str:
+    """
+    Escape a tag key, tag value or field key.
+    """
+
+    return (key.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=")
+            .replace(" ", "\\ ").replace("\n", "\\n"))
+
+
+def encode_tags(tags: dict) -> str:
+    """
+    Encode tags as ",key=value,..." sorted by key. Tags with an empty
+    value are left out since line protocol can't represent them.
+    """
+
+    return "".join(f",{escape_key(str(key))}={escape_key(str(tags[key]))}"
+                   for key in sorted(tags)
+                   if tags[key] is not None and tags[key] != "")
+
+
+def encode_value(value: object) -> Optional[str]:
+    """
+    Encode a field value, None if it can't be represented. Integers out
+    of range are refused, InfluxDB would reject the whole batch.
+    """
+
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        if not INT_MIN <= value <= INT_MAX:
+            raise PointError(f"Integer {value} out of range")
+        return f"{value}i"
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return None
+        return repr(value)
+    if isinstance(value, str):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    return None
+
+
+def encode_point(point: dict, extra_tags: Optional[dict] = None) -> str:
+    """
+    Encode a point in the InfluxDB JSON format as a line of line protocol.
+    extra_tags are added to the point's own tags, replacing any tag with
+    the same key.
+    """
+
+    try:
+        measurement = point["measurement"]
+        fields = point["fields"]
+    except (KeyError, TypeError):
+        raise PointError("Point needs a measurement and fields")
+
+    if not isinstance(measurement, str) or measurement == "":
+        raise PointError("Measurement must be a non-empty string")
+    if not isinstance(fields, dict):
+        raise PointError("Fields must be an object")
+
+    tags = point.get("tags") or {}
+
+    if not isinstance(tags, dict):
+        raise PointError("Tags must be an object")
+
+    if extra_tags:
+        tags = dict(tags)
+        tags.update(extra_tags)
+
+    encoded = []
+    for key, value in fields.items():
+        value = encode_value(value)
+        if value is not None:
+            encoded.append(f"{escape_key(str(key))}={value}")
+
+    if not encoded:
+        raise PointError("Point has no valid fields")
+
+    line = escape_measurement(measurement) + encode_tags(tags)
+    line += " " + ",".join(encoded)
+
+    timestamp = point.get("time")
+
+    if timestamp is not None:
+        if not isinstance(timestamp, int) or isinstance(timestamp, bool):
+            raise PointError("Time must be an integer in nanoseconds")
+        line += f" {timestamp}"
+
+    return line
+
+
+class LineEncoder(object):
+    def __init__(self, cache_size: Optional[int] = 10000) -> None:
+        """
+        Encoder for many points sharing measurement names, field keys and
+        tags, as points from the same worker do. Escaped names and
+        encoded tag strings are cached, and points whose own tags are all
+        replaced by the extra tags reuse the encoded extra tags as is.
+        """
+
+        self.cache_size = cache_size
+
+        self.__names = {}
+        self.__keys = {}
+        self.__tags = {}
+
+    def __cached(self, cache: dict, key: object, func: Callable) -> str:
+        value = cache.get(key)
+
+        if value is None:
+            if len(cache) >= self.cache_size:
+                cache.clear()
+            value = cache[key] = func(key)
+
+        return value
+
+    def tags(self, tags: dict) -> str:
+        """
+        Encode tags like encode_tags(), from the cache if possible.
+        """
+
+        try:
+            key = tuple(sorted(tags.items()))
+            return self.__cached(self.__tags, key, lambda items: encode_tags(tags))
+        except TypeError:
+            # Unhashable or unorderable tags are encoded every time
+            return encode_tags(tags)
+
+    def encode(self, points: object, extra_tags: Optional[dict] = None,
+               out: Optional[list] = None) -> list:
+        """
+        Encode points like encode_point(), appending the lines to out if
+        given, and return the lines.
+        """
+
+        if out is None:
+            out = []
+
+        extra_tags = extra_tags or {}
+        extra = self.tags(extra_tags)
+        names = self.__names
+        keys = self.__keys
+        append = out.append
+
+        for point in points:
+            try:
+                measurement = point["measurement"]
+                fields = point["fields"]
+            except (KeyError, TypeError):
+                raise PointError("Point needs a measurement and fields")
+
+            if measurement.__class__ is not str or measurement == "":
+                raise PointError("Measurement must be a non-empty string")
+
+            name = names.get(measurement)
+            if name is None:
+                name = self.__cached(names, measurement, escape_measurement)
+
+            if not isinstance(fields, dict):
+                raise PointError("Fields must be an object")
+
+            tags = point.get("tags")
+
+            if not tags:
+                tagstr = extra
+            elif not isinstance(tags, dict):
+                raise PointError("Tags must be an object")
+            elif tags.keys() <= extra_tags.keys():
+                tagstr = extra
+            else:
+                tagstr = self.tags(dict(tags, **extra_tags))
+
+            encoded = []
+            for key, value in fields.items():
+                if value.__class__ is float:
+                    if value != value or value in (math.inf, -math.inf):
+                        continue
+                    value = repr(value)
+                else:
+                    value = encode_value(value)
+                    if value is None:
+                        continue
+
+                escaped = keys.get(key)
+                if escaped is None:
+                    escaped = self.__cached(keys, key, lambda key: escape_key(str(key)))
+
+                encoded.append(f"{escaped}={value}")
+
+            if not encoded:
+                raise PointError("Point has no valid fields")
+
+            timestamp = point.get("time")
+
+            if timestamp is None:
+                append(f"{name}{tagstr} {','.join(encoded)}")
+            elif timestamp.__class__ is int:
+                append(f"{name}{tagstr} {','.join(encoded)} {timestamp}")
+            else:
+                raise PointError("Time must be an integer in nanoseconds")
+
+        return out
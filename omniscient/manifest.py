@@ -0,0 +1,84 @@
+import threading
+from typing import Optional
+
+import requests
+
+from omniscient.log import get_logger
+from omniscient.signher import MANIFEST, verify_manifest
+
+log = get_logger()
+
+
+class Manifest(object):
+    def __init__(self, url: str, cert_path: Optional[str] = "certs/public.cert",
+                 session: Optional[requests.Session] = None) -> None:
+        """
+        Signed list of the sha256 of every check script on the master.
+        A script whose hash is in a verified manifest needs no signature
+        of its own.
+        """
+
+        self.url = url + "/checks/" + MANIFEST
+        self.cert_path = cert_path
+        self.session = session or requests.Session()
+
+        self.__lock = threading.Lock()
+        self.__checks = {}
+        self.__etag = None
+
+    def update(self) -> bool:
+        """
+        Fetch the manifest if it changed and verify it. Returns False if
+        the manifest couldn't be fetched or verified, in which case the
+        last verified one is kept.
+        """
+
+        with self.__lock:
+            headers = {}
+            if self.__etag:
+                headers["If-None-Match"] = self.__etag
+
+            try:
+                res = self.session.get(self.url, headers=headers, timeout=30)
+
+                if res.status_code == 304:
+                    return True
+
+                if res.status_code != 200:
+                    log.debug(f"No manifest at {self.url} ({res.status_code})")
+                    return False
+
+                data = res.content
+                etag = res.headers.get("ETag")
+                res = self.session.get(self.url + ".sig", timeout=30)
+
+                if res.status_code != 200:
+                    log.error(f"Failed to download manifest signature from {self.url}.sig")
+                    return False
+
+                checks = verify_manifest(data, res.content.decode(), self.cert_path)
+            except requests.exceptions.RequestException as e:
+                log.error(f"Failed to download manifest from {self.url}: {e}")
+                return False
+            except (ValueError, OSError) as e:
+                log.error(f"Failed to verify manifest from {self.url}: {e}")
+                return False
+
+            if checks is None:
+                log.error("Manifest signature could not be verified")
+                return False
+
+            log.info(f"Verified manifest with {len(checks)} checks")
+
+            self.__checks = checks
+            self.__etag = etag
+
+        return True
+
+    def covers(self, name: str, filehash: str) -> bool:
+        """
+        Check if a script with the given name and hash is in the
+        verified manifest.
+        """
+
+        return filehash is not None and self.__checks.get(name) == filehash
@@ -0,0 +1,97 @@
+import threading
+from typing import Callable, Optional
+
+from omniscient.log import get_logger
+
+log = get_logger()
+
+
+class ChangeNotifier(object):
+    def __init__(self, probe: Callable, interval: Optional[float] = 1.0) -> None:
+        """
+        Wake up waiters when the state returned by probe changes. One
+        thread calls probe every interval seconds, waiters don't look for
+        changes themselves and cost nothing until something changes.
+        """
+
+        self.probe = probe
+        self.interval = interval
+
+        self.__cond = threading.Condition()
+        self.__version = 0
+        self.__state = None
+        self.__stopping = False
+        self.__stop_soon = False
+        self.__thread = None
+
+    def __run(self) -> None:
+        while True:
+            try:
+                state = self.probe()
+            except Exception as e:
+                log.error(f"Failed to check for changes: {e}")
+                state = self.__state
+
+            with self.__cond:
+                if self.__stop_soon:
+                    self.__stopping = True
+                    self.__cond.notify_all()
+
+                if self.__stopping:
+                    return
+
+                if state != self.__state:
+                    self.__state = state
+                    self.__version += 1
+                    self.__cond.notify_all()
+
+                self.__cond.wait(self.interval)
+
+    def start(self) -> None:
+        """
+        Start looking for changes.
+        """
+
+        if self.__thread and self.__thread.is_alive():
+            return
+
+        self.__stopping = False
+        self.__stop_soon = False
+        self.__thread = threading.Thread(target=self.__run, name="notifier", daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop looking for changes and wake up all waiters.
+        """
+
+        with self.__cond:
+            self.__stopping = True
+            self.__cond.notify_all()
+
+    def stop_soon(self) -> None:
+        """
+        Like stop(), but done by the notifier thread within interval
+        seconds. Takes no lock, so it can be called from a signal handler.
+        """
+
+        self.__stop_soon = True
+
+    def version(self) -> int:
+        """
+        Number of changes seen so far.
+        """
+
+        return self.__version
+
+    def wait(self, version: int, timeout: float) -> bool:
+        """
+        Wait up to timeout seconds for a change after version. Returns
+        False if the notifier was stopped.
+        """
+
+        with self.__cond:
+            self.__cond.wait_for(
+                lambda: self.__version != version or self.__stopping, timeout)
+
+            return not self.__stopping
@@ -0,0 +1,55 @@
+import hashlib
+import threading
+import types
+
+from omniscient.log import get_logger
+
+log = get_logger()
+
+# Loaded plugin modules by the sha256 of their source
+modules = {}
+modules_lock = threading.Lock()
+
+
+class PluginError(Exception):
+    pass
+
+
+def load(filename: str, filehash: str) -> types.ModuleType:
+    """
+    Load a check plugin. The source is read once and only run if it still
+    has the hash it was verified with. A plugin is a Python module with a
+    function check(args, timeout) returning a dict of fields.
+    """
+
+    with modules_lock:
+        if filehash in modules:
+            return modules[filehash]
+
+    try:
+        with open(filename, "rb") as fd:
+            source = fd.read()
+    except OSError as e:
+        raise PluginError(f"Failed to read plugin {filename}: {e}")
+
+    if hashlib.sha256(source).hexdigest() != filehash:
+        raise PluginError(f"Plugin {filename} doesn't match hash {filehash}")
+
+    module = types.ModuleType(f"omniscient_plugin_{filehash[:16]}")
+    module.__file__ = filename
+
+    try:
+        exec(compile(source, filename, "exec"), module.__dict__)
+    except Exception as e:
+        raise PluginError(f"Failed to load plugin {filename}: {e}")
+
+    if not callable(getattr(module, "check", None)):
+        raise PluginError(f"Plugin {filename} has no check function")
+
+    log.debug(f"Loaded plugin {filename}")
+
+    with modules_lock:
+        modules[filehash] = module
+
+    return module
+
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import threading
+from typing import Optional
+
+from omniscient.filestat import StatCache
+from omniscient.log import get_logger
+
+log = get_logger()
+
+
+class Artifact(object):
+    def __init__(self, name: str, data: bytes, signature: Optional[bytes],
+                 stat: tuple) -> None:
+        self.name = name
+        self.data = data
+        self.hash = hashlib.sha256(data).hexdigest()
+        self.signature = signature
+        self.stat = stat
+
+        if signature is not None:
+            self.signature_hash = hashlib.sha256(signature).hexdigest()
+        else:
+            self.signature_hash = None
+
+
+class CheckRegistry(object):
+    def __init__(self, path: Optional[str] = "checks",
+                 check_interval: Optional[float] = 1.0) -> None:
+        self.path = path
+        self.check_interval = check_interval
+
+        self.__lock = threading.Lock()
+        self.__artifacts = {}
+        self.__stats = StatCache(check_interval)
+
+    def __load(self, name: str, stat: tuple) -> Optional[Artifact]:
+        """
+        Read a check script and its signature.
+        """
+
+        filename = os.path.join(self.path, name)
+
+        try:
+            with open(filename, "rb") as fd:
+                data = fd.read()
+        except OSError as e:
+            log.error(f"Failed to read check {filename}: {e}")
+            return None
+
+        try:
+            with open(filename + ".sig", "rb") as fd:
+                signature = fd.read()
+        except OSError:
+            signature = None
+
+        log.debug(f"Loaded check {filename} into registry")
+
+        return Artifact(name, data, signature, stat)
+
+    def get(self, name: str) -> Optional[Artifact]:
+        """
+        Get a check script from the registry, re-reading it if it changed
+        on disk since it was last looked at.
+        """
+
+        # Only plain file names inside the checks directory are served
+        if name != os.path.basename(name) or name.startswith("."):
+            return None
+
+        filename = os.path.join(self.path, name)
+        stat = self.__stats.stat(filename)
+
+        if stat is None:
+            # Don't remember anything about names that aren't checks
+            self.__stats.forget(filename)
+            with self.__lock:
+                self.__artifacts.pop(name, None)
+            return None
+
+        stat = stat + (self.__stats.stat(filename + ".sig"),)
+        artifact = self.__artifacts.get(name)
+
+        if artifact is not None and artifact.stat == stat:
+            return artifact
+
+        with self.__lock:
+            artifact = self.__artifacts.get(name)
+
+            if artifact is None or artifact.stat != stat:
+                if not os.path.isfile(filename):
+                    return None
+
+                artifact = self.__load(name, stat)
+
+                if artifact is None:
+                    return None
+
+                self.__artifacts[name] = artifact
+
+        return artifact
+
+    def get_hash(self, name: str) -> Optional[str]:
+        """
+        Get the sha256 hash of a check script.
+        """
+
+        artifact = self.get(name)
+
+        if artifact is None:
+            return None
+
+        return artifact.hash
@@ -0,0 +1,241 @@
+import json
+from typing import Optional
+
+# Range of integer fields in line protocol
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+
+class ResultError(Exception):
+    pass
+
+
+def fields(result: object) -> dict:
+    """
+    Validate a dict of fields, leaving out fields without a value.
+    """
+
+    if not isinstance(result, dict):
+        raise ResultError(f"Fields must be a dict, not {type(result).__name__}")
+
+    valid = {}
+
+    for key, value in result.items():
+        if value is None:
+            continue
+        if not isinstance(key, str) or key == "":
+            raise ResultError(f"Invalid field name {key!r}")
+        if not isinstance(value, (bool, int, float, str)):
+            raise ResultError(f"Invalid value for field {key}: {value!r}")
+        if (isinstance(value, int) and not isinstance(value, bool) and
+                not INT_MIN <= value <= INT_MAX):
+            raise ResultError(f"Integer out of range for field {key}: {value}")
+        valid[key] = value
+
+    return valid
+
+
+def tags(result: object) -> dict:
+    """
+    Validate a dict of tags, converting the values to strings.
+    """
+
+    if not isinstance(result, dict):
+        raise ResultError(f"Tags must be a dict, not {type(result).__name__}")
+
+    valid = {}
+
+    for key, value in result.items():
+        if value is None or value == "":
+            continue
+        if not isinstance(key, str) or key == "":
+            raise ResultError(f"Invalid tag name {key!r}")
+        if not isinstance(value, (bool, int, float, str)):
+            raise ResultError(f"Invalid value for tag {key}: {value!r}")
+        valid[key] = str(value)
+
+    return valid
+
+
+def point(data: object) -> dict:
+    """
+    Build a partial point from a decoded JSON object. An object with a
+    "fields" member may also have "tags" and "time", any other object is
+    taken as the fields.
+    """
+
+    if not isinstance(data, dict):
+        raise ResultError("Result must be a JSON object or a list of them")
+
+    if not isinstance(data.get("fields"), dict):
+        data = {"fields": data}
+
+    parsed = {"fields": fields(data["fields"]), "tags": tags(data.get("tags") or {})}
+
+    if not parsed["fields"]:
+        raise ResultError("Result has no fields")
+
+    timestamp = data.get("time")
+
+    if timestamp is not None:
+        if not isinstance(timestamp, int) or isinstance(timestamp, bool):
+            raise ResultError("Time must be an integer in nanoseconds")
+        parsed["time"] = timestamp
+
+    return parsed
+
+
+def split(text: str, sep: str, maxsplit: Optional[int] = -1) -> list:
+    """
+    Split line protocol on a separator that isn't escaped or inside a
+    quoted string.
+    """
+
+    parts = []
+    current = []
+    escaped = False
+    quoted = False
+
+    for char in text:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            current.append(char)
+            escaped = True
+        elif char == '"':
+            current.append(char)
+            quoted = not quoted
+        elif char == sep and not quoted and maxsplit != 0:
+            parts.append("".join(current))
+            current = []
+            maxsplit -= 1
+        else:
+            current.append(char)
+
+    if quoted:
+        raise ResultError("Unterminated string")
+
+    parts.append("".join(current))
+
+    return parts
+
+
+def unescape(text: str) -> str:
+    """
+    Remove line protocol escapes.
+    """
+
+    out = []
+    escaped = False
+
+    for char in text:
+        if escaped or char != "\\":
+            out.append(char)
+            escaped = False
+        else:
+            escaped = True
+
+    return "".join(out)
+
+
+def value(text: str) -> object:
+    """
+    Decode a line protocol field value.
+    """
+
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"':
+        return text[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    if text in ("t", "T", "true", "True", "TRUE"):
+        return True
+    if text in ("f", "F", "false", "False", "FALSE"):
+        return False
+
+    try:
+        if text[-1:] in ("i", "u"):
+            number = int(text[:-1])
+            if not INT_MIN <= number <= INT_MAX:
+                raise ResultError(f"Integer out of range {text}")
+            return number
+        return float(text)
+    except ValueError:
+        raise ResultError(f"Invalid field value {text}")
+
+
+def line(text: str) -> dict:
+    """
+    Parse a line of line protocol into a partial point. The measurement
+    is ignored, points are reported under the name of the test.
+    """
+
+    parts = split(text, " ")
+
+    if len(parts) not in (2, 3):
+        raise ResultError(f"Invalid line {text}")
+
+    head = split(parts[0], ",")
+    parsed = {"tags": {}, "fields": {}}
+
+    if not head[0] or len(split(head[0], "=")) > 1:
+        raise ResultError(f"Invalid measurement {head[0]}")
+
+    for tag in head[1:]:
+        key, sep, val = tag.partition("=")
+        if not sep or not key or not val:
+            raise ResultError(f"Invalid tag {tag}")
+        parsed["tags"][unescape(key)] = unescape(val)
+
+    for field in split(parts[1], ","):
+        pair = split(field, "=", 1)
+        if len(pair) != 2 or not pair[0] or not pair[1]:
+            raise ResultError(f"Invalid field {field}")
+        parsed["fields"][unescape(pair[0])] = value(pair[1])
+
+    if len(parts) == 3:
+        try:
+            parsed["time"] = int(parts[2])
+        except ValueError:
+            raise ResultError(f"Invalid timestamp {parts[2]}")
+
+    return parsed
+
+
+def parse(output: bytes) -> list:
+    """
+    Parse the output of a check into partial points with fields, tags
+    and optionally a time. The output can be a JSON object, a list of
+    them, or lines of line protocol. Anything else is a single value,
+    reported as the field "result", as a number if it is one. Empty output
+    is an error, it would turn a numeric result into a string.
+    """
+
+    text = output.decode().strip()
+
+    if not text:
+        raise ResultError("Check produced no output")
+
+    if text[:1] in ("{", "["):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+
+        if isinstance(data, list):
+            return [point(item) for item in data]
+        if isinstance(data, dict):
+            return [point(data)]
+
+    lines = [item for item in text.splitlines() if item.strip()]
+
+    if lines and all(" " in item and "=" in item for item in lines):
+        try:
+            return [line(item) for item in lines]
+        except ResultError:
+            pass
+
+    try:
+        result = float(text)
+    except ValueError:
+        result = text
+
+    return [{"fields": {"result": result}, "tags": {}}]
@@ -1,11 +1,17 @@
+import asyncio
 import fcntl
-from datetime import datetime
+import hashlib
+import random
+import threading
+from datetime import datetime, timedelta
 from typing import Callable, Optional
 
 import flock
 from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+from apscheduler.executors.asyncio import AsyncIOExecutor
 from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.schedulers.background import BackgroundScheduler
 from pytz import utc
 
@@ -21,14 +27,50 @@ class JobError(Exception):
 
 class Scheduler(object):
     def __init__(self, nr_threads: Optional[int] = 100,
-                 lockfile: Optional[str] = "/tmp/scheduler.lock") -> None:
-        self.__scheduler = BackgroundScheduler(
-            executors={"default": ThreadPoolExecutor(nr_threads)},
-            jobstores={"default": MemoryJobStore()},
-            job_defaults={},
-            timezone=utc,
-        )
+                 lockfile: Optional[str] = "/tmp/scheduler.lock",
+                 executor: Optional[str] = "thread",
+                 concurrency: Optional[int] = 1000,
+                 spread: Optional[str] = "hash",
+                 seed: Optional[str] = "") -> None:
+        """
+        The "thread" executor runs each job in a pool of nr_threads
+        threads. The "asyncio" executor runs coroutine jobs on an event
+        loop in a single thread, with at most concurrency of them running
+        at the same time.
+
+        spread decides when the first run of a job happens within its
+        interval: "none" runs it right away, "hash" at a fixed offset
+        derived from seed and the job id, and "random" at a random offset.
+        """
+
+        if spread not in ("none", "hash", "random"):
+            raise ValueError(f"Unknown spread strategy {spread}")
+
+        if executor == "thread":
+            self.__loop = None
+            self.__scheduler = BackgroundScheduler(
+                executors={"default": ThreadPoolExecutor(nr_threads)},
+                jobstores={"default": MemoryJobStore()},
+                job_defaults={},
+                timezone=utc,
+            )
+        elif executor == "asyncio":
+            self.__loop = asyncio.new_event_loop()
+            self.__scheduler = AsyncIOScheduler(
+                event_loop=self.__loop,
+                executors={"default": AsyncIOExecutor()},
+                jobstores={"default": MemoryJobStore()},
+                job_defaults={},
+                timezone=utc,
+            )
+        else:
+            raise ValueError(f"Unknown executor {executor}")
 
+        self.executor = executor
+        self.concurrency = concurrency
+        self.spread = spread
+        self.seed = seed
+        self.__semaphore = None
         self.lockfile = lockfile
         self.started = False
         self.job_id = 0
@@ -62,13 +104,12 @@ class Scheduler(object):
 
         return False
 
-    def __launcher(self, func: Callable, **kwargs: dict) -> None:
+    def __count_run(self, kwargs: dict) -> None:
         """
-        Launches the function with the given arguments.
+        Counts a run of the job and removes it once it reached max runs.
         """
 
         job_id = kwargs["job_id"]
-        retval = None
         self.jobstore[job_id]["nr_runs"] += 1
 
         if "maxruns" in kwargs:
@@ -78,9 +119,32 @@ class Scheduler(object):
                     self.__scheduler.remove_job(job_id)
             del kwargs["maxruns"]
         del kwargs["job_id"]
-        retval = func(**kwargs)
 
-        return retval
+    def __launcher(self, func: Callable, **kwargs: dict) -> None:
+        """
+        Launches the function with the given arguments.
+        """
+
+        self.__count_run(kwargs)
+
+        if asyncio.iscoroutinefunction(func):
+            return asyncio.run(func(**kwargs))
+
+        return func(**kwargs)
+
+    async def __async_launcher(self, func: Callable, **kwargs: dict) -> None:
+        """
+        Launches the coroutine function with the given arguments on the
+        event loop, limiting the number of concurrently running jobs.
+        """
+
+        self.__count_run(kwargs)
+
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self.__semaphore:
+            return await func(**kwargs)
 
     def start(self) -> Optional[bool]:
         """
@@ -99,6 +163,10 @@ class Scheduler(object):
 
         log.info("Starting scheduler")
 
+        if self.__loop is not None:
+            threading.Thread(target=self.__loop.run_forever, name="scheduler",
+                             daemon=True).start()
+
         return self.__scheduler.start()
 
     def stop(self) -> Optional[bool]:
@@ -108,14 +176,48 @@ class Scheduler(object):
 
         if self.started:
             self.started = False
-        return self.__scheduler.shutdown()
+        retval = self.__scheduler.shutdown()
+
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+
+        return retval
+
+    def offset(self, key: str, interval: int) -> float:
+        """
+        Returns the delay in seconds before the first run of a job.
+        """
+
+        if interval <= 0 or self.spread == "none":
+            return 0.0
+
+        if self.spread == "random":
+            return random.uniform(0, interval)
+
+        digest = hashlib.sha256((self.seed + ":" + key).encode()).digest()
+
+        return int.from_bytes(digest[:8], "big") % (interval * 1000) / 1000
+
+    @staticmethod
+    def sanitize(job_id: str) -> str:
+        """
+        Turns a job name into a job id.
+        """
+
+        job_id = job_id.replace("-", "_")
+        job_id = job_id.replace(".", "_")
+        job_id = job_id.replace(":", "_")
+        job_id = job_id.replace(" ", "_")
+
+        return job_id
 
     def add(self, func: Callable, job_id: Optional[str] = "",
             comment: Optional[str] = "",
             timeout: Optional[int] = 120,
             interval: Optional[int] = 60,
             maxruns: Optional[int] = 1,
-            starttime: Optional[str] = None, **kwargs: dict) -> str:
+            starttime: Optional[str] = None,
+            spread_key: Optional[str] = None, **kwargs: dict) -> str:
         """
         Adds a job to the scheduler.
         """
@@ -126,10 +228,7 @@ class Scheduler(object):
             self.job_id += 1
             kwargs["job_id"] = str(self.job_id)
         else:
-            job_id = job_id.replace("-", "_")
-            job_id = job_id.replace(".", "_")
-            job_id = job_id.replace(":", "_")
-            job_id = job_id.replace(" ", "_")
+            job_id = self.sanitize(job_id)
 
             if job_id in self.jobstore:
                 raise JobError("Job already exists")
@@ -139,11 +238,17 @@ class Scheduler(object):
         kwargs["maxruns"] = maxruns + 1
         job_id = kwargs["job_id"]
 
+        if self.executor == "asyncio" and asyncio.iscoroutinefunction(func):
+            launcher = self.__async_launcher
+        else:
+            launcher = self.__launcher
+
         if not starttime:
-            starttime = datetime.utcnow()
+            delay = self.offset(spread_key or job_id, interval)
+            starttime = datetime.utcnow() + timedelta(seconds=delay)
 
-        self.jobstore[job_id] = {"nr_runs": 0}
-        self.__scheduler.add_job(self.__launcher, id=job_id,
+        self.jobstore[job_id] = {"nr_runs": 0, "spread_key": spread_key or job_id}
+        self.__scheduler.add_job(launcher, id=job_id,
                                  trigger="interval",
                                  misfire_grace_time=timeout,
                                  seconds=interval,
@@ -152,6 +257,32 @@ class Scheduler(object):
 
         return job_id
 
+    def update(self, job_id: str, interval: Optional[int] = None,
+               **kwargs: dict) -> None:
+        """
+        Updates the arguments of an existing job, keeping its run counter.
+        The next run time is only changed if the interval changes, in which
+        case the job is spread over the new interval like a new one.
+        """
+
+        job = self.__scheduler.get_job(job_id)
+
+        if job is None or job_id not in self.jobstore:
+            raise JobError(f"Job {job_id} does not exist")
+
+        if kwargs:
+            newkwargs = dict(job.kwargs)
+            newkwargs.update(kwargs)
+            self.__scheduler.modify_job(job_id, kwargs=newkwargs)
+
+        if interval is not None and job.trigger.interval.total_seconds() != interval:
+            log.info(f"Rescheduling job {job_id} with interval {interval}")
+            delay = self.offset(self.jobstore[job_id]["spread_key"], interval)
+            self.__scheduler.reschedule_job(job_id, trigger="interval",
+                                            seconds=interval,
+                                            start_date=datetime.utcnow() +
+                                            timedelta(seconds=delay))
+
     def add_error_listener(self, func: Callable) -> None:
         """
         Adds a listener for job errors.
@@ -0,0 +1,182 @@
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from omniscient.log import get_logger
+from omniscient.spool import MemorySpool
+
+log = get_logger()
+
+
+class Shipper(object):
+    def __init__(self, url: str, uuid: str, interval: Optional[float] = 5.0,
+                 batch_size: Optional[int] = 500,
+                 spool: Optional[object] = None,
+                 timeout: Optional[float] = 10.0,
+                 bulk: Optional[bool] = True) -> None:
+        """
+        Collect results from all checks and post them to the master in
+        batches over one keep-alive connection, either every interval
+        seconds or as soon as batch_size points are waiting.
+
+        Results are written to the spool first and only removed from it
+        once the master has accepted them, so anything queued during an
+        outage is replayed oldest first when the master is back.
+
+        With bulk set, batches are sent gzip compressed as JSON lines to
+        the bulk endpoint, falling back to the plain endpoint if the
+        master doesn't have it.
+        """
+
+        self.url = url + "/callhome?uuid=" + uuid
+        self.bulk_url = url + "/callhome/bulk?uuid=" + uuid
+        self.bulk = bulk
+        self.interval = interval
+        self.batch_size = batch_size
+        self.spool = spool if spool is not None else MemorySpool()
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+        self.__cond = threading.Condition()
+        self.__thread = None
+        self.__stopping = False
+        self.__rejected = 0
+
+    def start(self) -> None:
+        """
+        Start the shipper thread.
+        """
+
+        if self.__thread and self.__thread.is_alive():
+            return
+
+        self.__stopping = False
+        self.__thread = threading.Thread(target=self.__run, name="shipper", daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Stop the shipper after a last attempt to post what is queued.
+        """
+
+        with self.__cond:
+            self.__stopping = True
+            self.__cond.notify_all()
+
+        if self.__thread:
+            self.__thread.join(timeout)
+
+    def put(self, points: list) -> None:
+        """
+        Queue points for the master.
+        """
+
+        try:
+            self.spool.append(points)
+        except Exception as e:
+            log.error(f"Failed to spool {len(points)} points: {e}")
+            return
+
+        if self.spool.pending() >= self.batch_size:
+            with self.__cond:
+                self.__cond.notify_all()
+
+    def post(self, points: list) -> bool:
+        """
+        Send points to the master. Returns False if they should be sent
+        again, points the master refused for good are dropped.
+        """
+
+        try:
+            if self.bulk:
+                body = gzip.compress(
+                    b"".join(json.dumps(point).encode() + b"\n" for point in points),
+                    compresslevel=6)
+                res = self.session.post(self.bulk_url, data=body, timeout=self.timeout,
+                                        headers={"Content-Type": "application/x-ndjson",
+                                                 "Content-Encoding": "gzip"})
+
+                if res.status_code in (404, 405):
+                    log.info("Master has no bulk endpoint, falling back to /callhome")
+                    self.bulk = False
+
+            if not self.bulk:
+                res = self.session.post(self.url, json=points, timeout=self.timeout)
+        except Exception as e:
+            log.error(f"Failed to post {len(points)} points to {self.url}: {e}")
+            return False
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"Sent {len(points)} points to server:")
+            log.debug("\n" + json.dumps(points, indent=4))
+
+        if 400 <= res.status_code < 500 and res.status_code not in (408, 429):
+            # Sending the same points again would get the same answer
+            # and hold up everything queued behind them.
+            log.error(f"Server refused {len(points)} points with {res.status_code}, "
+                      f"dropping them: {res.text}")
+            self.__rejected += len(points)
+            return True
+
+        if res.status_code not in (200, 202):
+            log.error(f"Server responded with {res.status_code}")
+            return False
+
+        log.debug(f"Server responded with {res.status_code}")
+
+        return True
+
+    def rejected(self) -> int:
+        """
+        Number of points dropped because the master refused them.
+        """
+
+        return self.__rejected
+
+    def __wait(self) -> None:
+        """
+        Wait until it is time to ship.
+        """
+
+        # Jitter keeps workers started together from posting in lockstep
+        deadline = time.monotonic() + self.interval * random.uniform(0.8, 1.2)
+
+        with self.__cond:
+            while not self.__stopping and self.spool.pending() < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.__cond.wait(remaining)
+
+    def __run(self) -> None:
+        """
+        Shipper loop.
+        """
+
+        while True:
+            self.__wait()
+
+            batch, cursor = self.spool.read(self.batch_size)
+
+            if batch:
+                if not self.post(batch):
+                    if self.__stopping:
+                        log.error(f"Giving up on {self.spool.pending()} unsent points")
+                        return
+                    time.sleep(self.interval)
+                    continue
+
+                self.spool.commit(cursor)
+
+            if self.__stopping and (not batch or not self.spool.pending()):
+                return
@@ -1,33 +1,108 @@
+import hashlib
+import json
+import os
 import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from OpenSSL import crypto
 
+from omniscient.filestat import StatCache
 
-def ssl_sign(data: str, key_path: str) -> bytes:
+# Parsed certificates by path, and signatures already verified by
+# (content sha256, signature, certificate fingerprint).
+certificates = {}
+certificate_stats = StatCache()
+verified = OrderedDict()
+verified_size = 4096
+cache_lock = threading.Lock()
+
+MANIFEST = "MANIFEST.json"
+
+
+def load_private_key(key_path: str) -> crypto.PKey:
     with open(key_path, "r") as fd:
         key = fd.read()
 
     try:
-        key = crypto.load_privatekey(crypto.FILETYPE_PEM, key)
-        signature = crypto.sign(key, data, "sha256")
+        return crypto.load_privatekey(crypto.FILETYPE_PEM, key)
+    except crypto.Error as e:
+        print(f"Failed to load private key: {e}")
+        sys.exit(1)
+
+
+def sign_data(data: bytes, key: crypto.PKey) -> bytes:
+    try:
+        return crypto.sign(key, data, "sha256")
     except crypto.Error as e:
         print(f"Failed to sign file: {e}")
         sys.exit(1)
 
-    return signature
 
+def ssl_sign(data: str, key_path: str) -> bytes:
+    return sign_data(data, load_private_key(key_path))
+
+
+def load_certificate(cert_path: str) -> tuple:
+    """
+    Load a certificate and its sha256 fingerprint, parsing the file again
+    only if it changed.
+    """
+
+    stat = certificate_stats.stat(cert_path)
+
+    if stat is None:
+        raise FileNotFoundError(f"Certificate {cert_path} not found")
+
+    with cache_lock:
+        if cert_path in certificates and certificates[cert_path][0] == stat:
+            return certificates[cert_path][1:]
 
-def ssl_verify(data: str, signature: str, cert_path: str) -> bool:
     with open(cert_path, "r") as fd:
-        cert = fd.read()
+        cert = crypto.load_certificate(crypto.FILETYPE_PEM, fd.read())
+
+    fingerprint = cert.digest("sha256").decode()
+
+    with cache_lock:
+        certificates[cert_path] = (stat, cert, fingerprint)
+
+    return cert, fingerprint
 
+
+def ssl_verify(data: str, signature: str, cert_path: str) -> bool:
     try:
-        crypt = crypto.load_certificate(crypto.FILETYPE_PEM, cert)
-        crypto.verify(crypt, bytes.fromhex(signature), data, "sha256")
+        crypt, fingerprint = load_certificate(cert_path)
     except crypto.Error as e:
+        print(f"Failed to load certificate: {e}")
+        return False
+
+    if isinstance(data, str):
+        digest = hashlib.sha256(data.encode()).hexdigest()
+    else:
+        digest = hashlib.sha256(data).hexdigest()
+
+    key = (digest, signature, fingerprint)
+
+    with cache_lock:
+        if key in verified:
+            verified.move_to_end(key)
+            return True
+
+    try:
+        crypto.verify(crypt, bytes.fromhex(signature), data, "sha256")
+    except (crypto.Error, ValueError) as e:
         print(f"Failed to verify file: {e}")
         return False
 
+    # Only successful verifications are remembered, anything else is
+    # checked again next time.
+    with cache_lock:
+        verified[key] = True
+        if len(verified) > verified_size:
+            verified.popitem(last=False)
+
     return True
 
 
@@ -58,3 +133,57 @@ def verify_file(file_path: str, sign_path: str, cert_path: str) -> bool:
         return None
 
     return ssl_verify(file_data, sign_data.decode(), cert_path)
+
+
+def sign_directory(path: str, key_path: str, workers: Optional[int] = 8) -> dict:
+    """
+    Sign every file in a directory with one load of the key, writing a
+    .sig next to each of them, and write a signed manifest of the
+    sha256 of every file.
+    """
+
+    key = load_private_key(key_path)
+    names = sorted(
+        name for name in os.listdir(path)
+        if os.path.isfile(os.path.join(path, name))
+        and not name.endswith(".sig") and name != MANIFEST)
+
+    def sign_one(name: str) -> str:
+        filename = os.path.join(path, name)
+
+        with open(filename, "rb") as fd:
+            data = fd.read()
+
+        with open(filename + ".sig", "w") as fd:
+            fd.write(sign_data(data, key).hex())
+
+        return hashlib.sha256(data).hexdigest()
+
+    with ThreadPoolExecutor(workers) as executor:
+        hashes = dict(zip(names, executor.map(sign_one, names)))
+
+    manifest = json.dumps({"checks": hashes}, indent=2, sort_keys=True).encode()
+    filename = os.path.join(path, MANIFEST)
+
+    with open(filename, "wb") as fd:
+        fd.write(manifest)
+
+    with open(filename + ".sig", "w") as fd:
+        fd.write(sign_data(manifest, key).hex())
+
+    return hashes
+
+
+def verify_manifest(data: bytes, signature: str, cert_path: str) -> Optional[dict]:
+    """
+    Verify a signed manifest and return its name to sha256 mapping, None
+    if the signature doesn't match.
+    """
+
+    if not ssl_verify(data, signature, cert_path):
+        return None
+
+    try:
+        return json.loads(data)["checks"]
+    except (ValueError, KeyError, TypeError):
+        return None
@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
+
+from omniscient.log import get_logger
+
+log = get_logger()
+
+
+class RejectedError(Exception):
+    """
+    Raised by a sink that refused a batch for good, retrying it as is
+    won't help.
+    """
+
+
+def line_key(line: str) -> tuple:
+    """
+    Get the measurement and timestamp of a line of line protocol, the
+    timestamp being None if the line has none.
+    """
+
+    measurement = []
+    escaped = False
+
+    for char in line:
+        if escaped:
+            measurement.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in (",", " "):
+            break
+        else:
+            measurement.append(char)
+
+    tail = line.rsplit(" ", 1)[-1]
+    timestamp = int(tail) if tail.lstrip("-").isdigit() else None
+
+    return "".join(measurement), timestamp
+
+
+class Sink(ABC):
+    """
+    Destination for points encoded as line protocol.
+    """
+
+    name = "sink"
+
+    @abstractmethod
+    def write(self, lines: list) -> bool:
+        """
+        Write lines, returning False if they should be retried. Raises
+        RejectedError if some of the lines can never be written.
+        """
+
+    def close(self) -> None:
+        """
+        Release the resources of the sink.
+        """
+
+
+class InfluxSink(Sink):
+    name = "influx"
+
+    def __init__(self, host: Optional[str] = "localhost", port: Optional[int] = 8086,
+                 database: Optional[str] = "testdb") -> None:
+        """
+        Write points to InfluxDB.
+        """
+
+        self.client = InfluxDBClient(host=host, port=port)
+        self.client.switch_database(database)
+
+    def write(self, lines: list) -> bool:
+        try:
+            if self.client.write_points(lines, protocol="line"):
+                return True
+        except InfluxDBClientError as e:
+            # Timeouts and rate limiting are worth another try, other
+            # client errors such as a field type conflict are not.
+            if e.code is not None and 400 <= e.code < 500 and e.code not in (408, 429):
+                raise RejectedError(e.content)
+            raise
+        return False
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class FileSink(Sink):
+    name = "file"
+
+    def __init__(self, path: Optional[str] = "/tmp/omniscient-points.{pid}.lp",
+                 max_size: Optional[int] = 64 * 1024 * 1024,
+                 backups: Optional[int] = 5) -> None:
+        """
+        Append points as line protocol to a local file. The file is
+        rotated to path.1, path.2, ... when it grows beyond max_size
+        bytes, keeping at most backups old files. "{pid}" in path is
+        replaced by the process id, so that server processes don't write
+        to the same file.
+        """
+
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self.max_size = max_size
+        self.backups = backups
+
+        self.__lock = threading.Lock()
+        self.__fd = open(self.path, "ab")
+        self.__size = self.__fd.tell()
+
+    def __rotate(self) -> None:
+        self.__fd.close()
+
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.unlink(self.path)
+
+        log.info(f"Rotated point file {self.path}")
+
+        self.__fd = open(self.path, "ab")
+        self.__size = 0
+
+    def write(self, lines: list) -> bool:
+        data = ("\n".join(lines) + "\n").encode()
+
+        with self.__lock:
+            if self.__size > 0 and self.__size + len(data) > self.max_size:
+                self.__rotate()
+
+            self.__fd.write(data)
+            self.__fd.flush()
+            self.__size += len(data)
+
+        return True
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__fd.close()
+
+
+class SQLiteSink(Sink):
+    name = "sqlite"
+
+    def __init__(self, path: Optional[str] = "/tmp/omniscient-points.db") -> None:
+        """
+        Store points in an SQLite database, one row per point with its
+        measurement, timestamp and line protocol. Every batch is inserted
+        in a single transaction.
+        """
+
+        self.path = path
+
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+        with self.__db:
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("PRAGMA synchronous=NORMAL")
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS points "
+                "(measurement TEXT NOT NULL, time INTEGER, line TEXT NOT NULL)")
+            self.__db.execute(
+                "CREATE INDEX IF NOT EXISTS points_measurement_time "
+                "ON points (measurement, time)")
+
+    def write(self, lines: list) -> bool:
+        rows = [line_key(line) + (line,) for line in lines]
+
+        with self.__lock:
+            with self.__db:
+                self.__db.executemany(
+                    "INSERT INTO points (measurement, time, line) VALUES (?, ?, ?)", rows)
+
+        return True
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__db.close()
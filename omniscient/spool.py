@@ -0,0 +1,324 @@
+import json
+import os
+import threading
+from collections import deque
+from typing import Optional
+
+from omniscient.log import get_logger
+
+log = get_logger()
+
+
+class MemorySpool(object):
+    def __init__(self, max_points: Optional[int] = 100000) -> None:
+        """
+        Non-durable spool that keeps results in memory only. Points are
+        numbered as they are added, so that a commit only removes the
+        points that were read even if older ones were dropped meanwhile.
+        """
+
+        self.max_points = max_points
+
+        self.__lock = threading.Lock()
+        self.__queue = deque()
+        # Number of the oldest point in the queue
+        self.__head = 0
+
+    def append(self, points: list) -> None:
+        """
+        Add points to the spool, dropping the oldest if it is full.
+        """
+
+        with self.__lock:
+            self.__queue.extend(points)
+
+            overflow = len(self.__queue) - self.max_points
+            if overflow > 0:
+                log.error(f"Spool full, dropping {overflow} oldest points")
+                for _ in range(overflow):
+                    self.__queue.popleft()
+                self.__head += overflow
+
+    def read(self, max_points: int) -> tuple:
+        """
+        Get up to max_points of the oldest points and a cursor to commit
+        once they have been delivered.
+        """
+
+        with self.__lock:
+            count = min(max_points, len(self.__queue))
+            points = [self.__queue[i] for i in range(count)]
+
+        return points, self.__head + count
+
+    def commit(self, cursor: int) -> None:
+        """
+        Remove points returned by read() from the spool.
+        """
+
+        with self.__lock:
+            count = min(cursor - self.__head, len(self.__queue))
+            for _ in range(count):
+                self.__queue.popleft()
+            self.__head += max(count, 0)
+
+    def pending(self) -> int:
+        """
+        Number of points waiting for delivery.
+        """
+
+        return len(self.__queue)
+
+
+class Spool(object):
+    def __init__(self, path: Optional[str] = "/tmp/omniscient-spool",
+                 segment_size: Optional[int] = 1024 * 1024,
+                 max_size: Optional[int] = 64 * 1024 * 1024) -> None:
+        """
+        Durable append-only spool. Points are stored as JSON lines in
+        numbered segment files under path, and the position of the oldest
+        undelivered point is kept in path/offset. Delivered segments are
+        removed, and the oldest segments are dropped if the spool grows
+        beyond max_size bytes.
+        """
+
+        self.path = path
+        self.segment_size = segment_size
+        self.max_size = max_size
+
+        self.__lock = threading.Lock()
+        self.__segments = []
+        self.__sizes = {}
+        self.__fd = None
+        self.__pending = 0
+
+        if not os.path.exists(self.path):
+            log.debug("Spool directory missing, creating")
+            os.makedirs(self.path)
+
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(".seg"):
+                seq = int(name[:-len(".seg")])
+                self.__segments.append(seq)
+                self.__sizes[seq] = os.path.getsize(self.__filename(seq))
+
+        self.__cursor = self.__load_offset()
+
+        for seq in [seq for seq in self.__segments if seq < self.__cursor[0]]:
+            self.__remove(seq)
+
+        if not self.__segments:
+            self.__segments.append(self.__cursor[0])
+            self.__sizes[self.__cursor[0]] = 0
+        elif self.__cursor[0] not in self.__segments:
+            self.__cursor = (self.__segments[0], 0)
+
+        self.__pending = self.__count()
+        self.__fd = open(self.__filename(self.__segments[-1]), "ab")
+
+        # Terminate a record left half written by a crash so that the
+        # next append doesn't end up on the same line.
+        if self.__sizes[self.__segments[-1]] > 0:
+            with open(self.__filename(self.__segments[-1]), "rb") as fd:
+                fd.seek(-1, os.SEEK_END)
+                if fd.read(1) != b"\n":
+                    self.__fd.write(b"\n")
+                    self.__fd.flush()
+                    self.__sizes[self.__segments[-1]] += 1
+
+        if self.__pending:
+            log.info(f"Spool {self.path} has {self.__pending} undelivered points")
+
+    def __filename(self, seq: int) -> str:
+        return os.path.join(self.path, f"{seq:020d}.seg")
+
+    def __load_offset(self) -> tuple:
+        """
+        Read the delivery position, defaulting to the oldest segment.
+        """
+
+        try:
+            with open(os.path.join(self.path, "offset")) as fd:
+                seq, offset = fd.read().split()
+                return (int(seq), int(offset))
+        except (OSError, ValueError):
+            pass
+
+        if self.__segments:
+            return (self.__segments[0], 0)
+
+        return (0, 0)
+
+    def __save_offset(self) -> None:
+        """
+        Atomically store the delivery position.
+        """
+
+        filename = os.path.join(self.path, "offset")
+
+        with open(filename + ".tmp", "w") as fd:
+            fd.write(f"{self.__cursor[0]} {self.__cursor[1]}\n")
+
+        os.replace(filename + ".tmp", filename)
+
+    def __count(self) -> int:
+        """
+        Count the undelivered points on disk.
+        """
+
+        count = 0
+
+        for seq in self.__segments:
+            offset = self.__cursor[1] if seq == self.__cursor[0] else 0
+            try:
+                with open(self.__filename(seq), "rb") as fd:
+                    fd.seek(offset)
+                    count += sum(1 for _ in fd)
+            except OSError:
+                pass
+
+        return count
+
+    def __remove(self, seq: int) -> None:
+        """
+        Remove a segment file.
+        """
+
+        try:
+            os.unlink(self.__filename(seq))
+        except OSError as e:
+            log.error(f"Failed to remove spool segment {seq}: {e}")
+
+        self.__segments.remove(seq)
+        del self.__sizes[seq]
+
+    def __rotate(self) -> None:
+        """
+        Start writing to a new segment.
+        """
+
+        self.__fd.close()
+
+        seq = self.__segments[-1] + 1
+        self.__segments.append(seq)
+        self.__sizes[seq] = 0
+        self.__fd = open(self.__filename(seq), "ab")
+
+    def __enforce_size(self) -> None:
+        """
+        Drop the oldest segments while the spool is over its size cap.
+        """
+
+        while len(self.__segments) > 1 and sum(self.__sizes.values()) > self.max_size:
+            seq = self.__segments[0]
+
+            with open(self.__filename(seq), "rb") as fd:
+                if seq == self.__cursor[0]:
+                    fd.seek(self.__cursor[1])
+                dropped = sum(1 for _ in fd)
+
+            log.error(f"Spool over {self.max_size} bytes, dropping {dropped} oldest points")
+
+            self.__remove(seq)
+            self.__pending -= dropped
+
+            if self.__cursor[0] <= seq:
+                self.__cursor = (self.__segments[0], 0)
+                self.__save_offset()
+
+    def append(self, points: list) -> None:
+        """
+        Write points to the spool.
+        """
+
+        data = b"".join(json.dumps(point).encode() + b"\n" for point in points)
+
+        with self.__lock:
+            self.__fd.write(data)
+            self.__fd.flush()
+            self.__sizes[self.__segments[-1]] += len(data)
+            self.__pending += len(points)
+
+            if self.__sizes[self.__segments[-1]] >= self.segment_size:
+                self.__rotate()
+                self.__enforce_size()
+
+    def read(self, max_points: int) -> tuple:
+        """
+        Get up to max_points of the oldest undelivered points and a cursor
+        to commit once they have been delivered.
+        """
+
+        points = []
+        records = 0
+
+        with self.__lock:
+            seq, offset = self.__cursor
+
+            while len(points) < max_points:
+                try:
+                    fd = open(self.__filename(seq), "rb")
+                except OSError:
+                    break
+
+                with fd:
+                    fd.seek(offset)
+                    for line in fd:
+                        if not line.endswith(b"\n"):
+                            break
+                        offset += len(line)
+                        records += 1
+                        try:
+                            points.append(json.loads(line))
+                        except ValueError:
+                            log.error(f"Skipping corrupt record in spool segment {seq}")
+                        if len(points) >= max_points:
+                            break
+
+                if len(points) >= max_points or seq == self.__segments[-1]:
+                    break
+
+                later = [s for s in self.__segments if s > seq]
+                if not later:
+                    break
+                seq, offset = later[0], 0
+
+        return points, (seq, offset, records)
+
+    def commit(self, cursor: tuple) -> None:
+        """
+        Mark the points returned by read() as delivered, removing
+        segments that are no longer needed.
+        """
+
+        seq, offset, count = cursor
+
+        with self.__lock:
+            if seq not in self.__segments:
+                # The segment was dropped by the size cap meanwhile
+                self.__cursor = (self.__segments[0], 0)
+                self.__save_offset()
+                return
+
+            self.__cursor = (seq, offset)
+            self.__pending = max(self.__pending - count, 0)
+
+            for old in [s for s in self.__segments if s < seq]:
+                self.__remove(old)
+
+            # Everything is delivered, reuse the current segment from the
+            # start instead of letting it grow.
+            if seq == self.__segments[-1] and offset >= self.__sizes[seq]:
+                self.__fd.truncate(0)
+                self.__sizes[seq] = 0
+                self.__cursor = (seq, 0)
+                self.__pending = 0
+
+            self.__save_offset()
+
+    def pending(self) -> int:
+        """
+        Number of points waiting for delivery.
+        """
+
+        return self.__pending
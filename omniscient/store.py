@@ -0,0 +1,138 @@
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+from typing import Optional
+
+from omniscient.log import get_logger
+
+log = get_logger()
+
+
+class ScriptStore(object):
+    def __init__(self, path: Optional[str] = "/tmp/scripts") -> None:
+        """
+        Content addressed store of check scripts. Every script is kept
+        once under its sha256, so checks using the same script share one
+        copy and a script that changes back and forth is only downloaded
+        once. Files are written to a temporary name and renamed into
+        place, so a script is never seen half written.
+        """
+
+        self.path = path
+
+        self.__lock = threading.Lock()
+        self.__refs = {}
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def filename(self, filehash: str) -> str:
+        """
+        Get the path of the script with the given hash.
+        """
+
+        return os.path.join(self.path, filehash)
+
+    def has(self, filehash: str) -> bool:
+        """
+        Check if a script with the given hash is stored and intact.
+        """
+
+        try:
+            with open(self.filename(filehash), "rb") as fd:
+                return hashlib.sha256(fd.read()).hexdigest() == filehash
+        except OSError:
+            return False
+
+    def signature(self, filehash: str) -> Optional[bytes]:
+        """
+        Get the stored signature of a script, None if there is none.
+        """
+
+        try:
+            with open(self.filename(filehash) + ".sig", "rb") as fd:
+                return fd.read()
+        except OSError:
+            return None
+
+    def __write(self, filename: str, data: bytes, mode: int) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            os.chmod(tmp, mode)
+            os.replace(tmp, filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def put(self, data: bytes, signature: Optional[bytes] = None) -> str:
+        """
+        Store a script and its signature, returning its hash.
+        """
+
+        filehash = hashlib.sha256(data).hexdigest()
+        filename = self.filename(filehash)
+
+        # The signature goes first so that the script is never in place
+        # without it.
+        if signature is not None:
+            self.__write(filename + ".sig", signature, stat.S_IRUSR | stat.S_IWUSR)
+        self.__write(filename, data, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+
+        return filehash
+
+    def acquire(self, filehash: str) -> None:
+        """
+        Mark a script as in use so that cleanup() keeps it.
+        """
+
+        with self.__lock:
+            self.__refs[filehash] = self.__refs.get(filehash, 0) + 1
+
+    def release(self, filehash: str) -> None:
+        """
+        Drop a reference taken with acquire().
+        """
+
+        with self.__lock:
+            if filehash not in self.__refs:
+                return
+            self.__refs[filehash] -= 1
+            if self.__refs[filehash] <= 0:
+                del self.__refs[filehash]
+
+    def cleanup(self) -> int:
+        """
+        Remove stored scripts no check refers to anymore, returning how
+        many were removed. A process still running a removed script is
+        not affected.
+        """
+
+        removed = 0
+
+        with self.__lock:
+            for name in os.listdir(self.path):
+                # Leave files still being written alone
+                if name.startswith("."):
+                    continue
+
+                filehash = name[:-len(".sig")] if name.endswith(".sig") else name
+
+                if filehash in self.__refs:
+                    continue
+
+                try:
+                    os.unlink(os.path.join(self.path, name))
+                except OSError as e:
+                    log.error(f"Failed to remove stale script {name}: {e}")
+                    continue
+
+                if not name.endswith(".sig"):
+                    removed += 1
+
+        if removed:
+            log.info(f"Removed {removed} stale scripts")
+
+        return removed
@@ -6,26 +6,27 @@ from jsonschema import validate
 from jsonschema.exceptions import SchemaError, ValidationError
 
 
-def config_validate(
-    config: Optional[str] = "config.json", schema: Optional[str] = "config-schema.json"
-) -> list:
+def config_errors(config: dict, schema: Optional[str] = "config-schema.json") -> list:
+    """
+    Validate an already parsed config against the schema and return
+    a list of errors, empty if the config is valid.
+    """
 
     errors = []
 
-    # Open the config file and the schema file
     try:
-        with open(config, "r") as file:
-            config = json.load(file)
-        with open("config-schema.json", "r") as file:
+        with open(schema, "r") as file:
             schema = json.load(file)
     except FileNotFoundError:
-        errors.append(f"File {config} not found")
+        errors.append(f"File {schema} not found")
     except json.JSONDecodeError as e:
-        errors.append(f"File {config} is not a valid JSON file: {e}")
+        errors.append(f"File {schema} is not a valid JSON file: {e}")
     except Exception as e:
         errors.append(f"An error occurred: {e}")
 
-    # Validate the config file against the schema
+    if errors:
+        return errors
+
     try:
         validate(config, schema)
     except ValidationError as e:
@@ -35,10 +36,36 @@ def config_validate(
     except Exception as e:
         errors.append(f"An error schema validation error occurred: {e}")
 
+    return errors
+
+
+def config_validate(
+    config: Optional[str] = "config.json", schema: Optional[str] = "config-schema.json"
+) -> list:
+
+    errors = []
+
+    # Open the config file
+    try:
+        with open(config, "r") as file:
+            config = json.load(file)
+    except FileNotFoundError:
+        errors.append(f"File {config} not found")
+    except json.JSONDecodeError as e:
+        errors.append(f"File {config} is not a valid JSON file: {e}")
+    except Exception as e:
+        errors.append(f"An error occurred: {e}")
+
+    # Validate the config file against the schema
+    if not errors:
+        errors = config_errors(config, schema)
+
     if errors:
         for num, error in enumerate(errors):
             print(f"{num}: {error}")
-            sys.exit(1)
+        sys.exit(1)
+
+    return errors
 
 
 if __name__ == "__main__":
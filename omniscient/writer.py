@@ -0,0 +1,335 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from omniscient.log import get_logger
+from omniscient.sink import RejectedError
+
+log = get_logger()
+
+
+class BatchWriter(object):
+    def __init__(self, write: Callable, batch_size: Optional[int] = 5000,
+                 max_age: Optional[float] = 1.0,
+                 max_queue: Optional[int] = 100000,
+                 policy: Optional[str] = "drop",
+                 spill_path: Optional[str] = None,
+                 put_timeout: Optional[float] = 0.0,
+                 max_retries: Optional[int] = 8) -> None:
+        """
+        Buffer points in memory and hand them to write() in batches of at
+        most batch_size points, or when the oldest buffered point is older
+        than max_age seconds.
+
+        When the buffer holds max_queue points new points are either
+        dropped (policy "drop") or appended to spill_path (policy "spill")
+        and replayed once the buffer has drained. A batch that still
+        fails after max_retries retries is handled the same way.
+
+        If write() raises RejectedError the batch is split to find the
+        points that were refused, which are dropped.
+        """
+
+        if policy not in ("drop", "spill"):
+            raise ValueError(f"Unknown overflow policy {policy}")
+        if policy == "spill" and not spill_path:
+            raise ValueError("Overflow policy spill needs a spill path")
+
+        self.write = write
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.max_queue = max_queue
+        self.policy = policy
+        self.spill_path = spill_path
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+
+        self.__cond = threading.Condition()
+        self.__queue = deque()
+        self.__oldest = None
+        self.__thread = None
+        self.__stopping = False
+        self.__spill_lock = threading.Lock()
+
+        self.__metrics = {
+            "queued": 0,
+            "written": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "rejected": 0,
+            "abandoned_batches": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "last_batch_size": 0,
+            "last_flush_latency": 0.0,
+            "max_flush_latency": 0.0,
+        }
+
+    def start(self) -> None:
+        """
+        Start the background flusher.
+        """
+
+        if self.__thread and self.__thread.is_alive():
+            return
+
+        self.__stopping = False
+        self.__thread = threading.Thread(target=self.__run, name="batchwriter",
+                                         daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Stop the flusher after writing what is left in the buffer.
+        """
+
+        with self.__cond:
+            self.__stopping = True
+            self.__cond.notify_all()
+
+        if self.__thread:
+            self.__thread.join(timeout)
+
+    def put(self, points: list) -> bool:
+        """
+        Queue points for writing. Returns False if the points were
+        dropped because the buffer is full.
+        """
+
+        if not points:
+            return True
+
+        deadline = time.monotonic() + self.put_timeout
+
+        with self.__cond:
+            while len(self.__queue) + len(points) > self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.__stopping:
+                    break
+                self.__cond.wait(remaining)
+            else:
+                if not self.__queue:
+                    self.__oldest = time.monotonic()
+                self.__queue.extend(points)
+                self.__metrics["queued"] += len(points)
+
+                if len(self.__queue) >= self.batch_size:
+                    self.__cond.notify_all()
+
+                return True
+
+        log.error("Write buffer full")
+
+        return self.__overflow(points)
+
+    def __overflow(self, points: list) -> bool:
+        """
+        Handle points that didn't fit in the buffer.
+        """
+
+        if self.policy == "spill":
+            try:
+                with self.__spill_lock:
+                    with open(self.spill_path, "a") as fd:
+                        for point in points:
+                            fd.write(json.dumps(point) + "\n")
+                self.__metrics["spilled"] += len(points)
+                return True
+            except Exception as e:
+                log.error(f"Failed to spill points to {self.spill_path}: {e}")
+
+        self.__metrics["dropped"] += len(points)
+        log.error(f"Dropped {len(points)} points")
+
+        return False
+
+    def __replay(self) -> None:
+        """
+        Move spilled points back into the buffer once it has drained.
+        """
+
+        if self.policy != "spill" or not os.path.exists(self.spill_path):
+            return
+
+        # Several processes may share the spill file, the one that wins
+        # the rename replays it.
+        replay_path = f"{self.spill_path}.replay.{os.getpid()}"
+
+        with self.__spill_lock:
+            try:
+                os.rename(self.spill_path, replay_path)
+            except OSError:
+                return
+
+        points = []
+        try:
+            with open(replay_path) as fd:
+                for line in fd:
+                    points.append(json.loads(line))
+        except Exception as e:
+            log.error(f"Failed to replay spilled points from {replay_path}: {e}")
+
+        os.unlink(replay_path)
+
+        log.info(f"Replaying {len(points)} spilled points")
+        self.__metrics["replayed"] += len(points)
+
+        for i in range(0, len(points), self.batch_size):
+            self.put(points[i:i + self.batch_size])
+
+    def __take(self) -> list:
+        """
+        Wait for a full batch, an old enough point or shutdown and take a
+        batch off the buffer.
+        """
+
+        with self.__cond:
+            while not self.__stopping:
+                if len(self.__queue) >= self.batch_size:
+                    break
+                if self.__queue:
+                    age = time.monotonic() - self.__oldest
+                    if age >= self.max_age:
+                        break
+                    self.__cond.wait(self.max_age - age)
+                else:
+                    self.__cond.wait(self.max_age)
+                    if not self.__queue:
+                        return []
+
+            count = min(self.batch_size, len(self.__queue))
+            batch = [self.__queue.popleft() for _ in range(count)]
+            self.__oldest = time.monotonic() if self.__queue else None
+            self.__cond.notify_all()
+
+        return batch
+
+    def __requeue(self, batch: list) -> None:
+        """
+        Put a batch that failed to write back in front of the buffer.
+        """
+
+        with self.__cond:
+            room = self.max_queue - len(self.__queue)
+            if room < len(batch):
+                overflow, batch = batch[room:], batch[:room]
+            else:
+                overflow = []
+            self.__queue.extendleft(reversed(batch))
+            self.__oldest = time.monotonic()
+
+        if overflow:
+            self.__overflow(overflow)
+
+    def __flush(self, batch: list) -> bool:
+        """
+        Write a batch and record how long it took.
+        """
+
+        start = time.monotonic()
+        success = False
+
+        try:
+            success = self.write(batch)
+        except RejectedError:
+            raise
+        except Exception as e:
+            log.error(f"Failed to write {len(batch)} points: {e}")
+        finally:
+            latency = time.monotonic() - start
+
+            self.__metrics["flushes"] += 1
+            self.__metrics["last_batch_size"] = len(batch)
+            self.__metrics["last_flush_latency"] = latency
+            self.__metrics["max_flush_latency"] = max(
+                latency, self.__metrics["max_flush_latency"])
+
+            if success:
+                self.__metrics["written"] += len(batch)
+            else:
+                self.__metrics["failed_flushes"] += 1
+
+        return success
+
+    def __run(self) -> None:
+        """
+        Flusher loop.
+        """
+
+        backoff = 0
+        retries = 0
+        # Halves of rejected batches, written before anything new. Points
+        # of a half that was partially written are written again, which
+        # doesn't duplicate them since every point has its time.
+        parts = deque()
+
+        while True:
+            batch = parts.popleft() if parts else self.__take()
+
+            if not batch:
+                if self.__stopping:
+                    return
+                self.__replay()
+                continue
+
+            try:
+                if self.__flush(batch):
+                    backoff = 0
+                    retries = 0
+                    continue
+            except RejectedError as e:
+                if len(batch) == 1:
+                    self.__metrics["rejected"] += 1
+                    log.error(f"Dropping point rejected by the sink: {e}: {batch[0]}")
+                else:
+                    half = len(batch) // 2
+                    parts.extendleft([batch[half:], batch[:half]])
+                continue
+
+            for part in parts:
+                batch += part
+            parts.clear()
+
+            retries += 1
+
+            if retries > self.max_retries and not self.__stopping:
+                log.error(f"Giving up on {len(batch)} points after {self.max_retries} retries")
+                self.__metrics["abandoned_batches"] += 1
+                self.__overflow(batch)
+                retries = 0
+                continue
+
+            self.__requeue(batch)
+
+            if self.__stopping:
+                with self.__cond:
+                    points = list(self.__queue)
+                    self.__queue.clear()
+                log.error(f"Giving up on {len(points)} unwritten points")
+                self.__overflow(points)
+                return
+
+            backoff = min(backoff * 2 or 1, 30)
+            time.sleep(backoff)
+
+    def depth(self) -> int:
+        """
+        Number of points waiting to be written.
+        """
+
+        return len(self.__queue)
+
+    def metrics(self) -> dict:
+        """
+        Get writer metrics.
+        """
+
+        metrics = dict(self.__metrics)
+        metrics["queue_depth"] = self.depth()
+        metrics["queue_size"] = self.max_queue
+
+        return metrics
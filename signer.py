@@ -1,7 +1,7 @@
 # openssl req -x509 -newkey rsa:2048 -keyout private.key -out public.cert -days 365
 import sys
 
-from omniscient.signher import sign_file, verify_file
+from omniscient.signher import MANIFEST, sign_directory, sign_file, verify_file
 
 
 def main():
@@ -21,6 +21,16 @@ def main():
 
         print(f"Signature written to {sys.argv[2]}.sig")
 
+    elif op == "sign-all":
+        if len(sys.argv) < 4:
+            print("Usage: python signer.py sign-all <directory> <key_path> [<threads>]")
+            sys.exit(1)
+
+        workers = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+        hashes = sign_directory(sys.argv[2], sys.argv[3], workers)
+
+        print(f"Signed {len(hashes)} files, manifest written to {sys.argv[2]}/{MANIFEST}")
+
     elif op == "verify":
         if len(sys.argv) < 5:
             print("Usage: python signer.py verify <file_path> <sign_path> <cert_path>")
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 
+import functools
 import getopt
 import getpass
-import json
 import logging
 import os
+import random
 import signal
 import sys
 import time
@@ -14,20 +15,41 @@ from typing import Optional
 import requests
 from apscheduler.events import JobEvent
 
-from omniscient import scheduler
-from omniscient.check import Check
+from omniscient import bundle, result, scheduler
+from omniscient.aggregate import Aggregator
+from omniscient.check import Check, CheckTimeout
+from omniscient.coalesce import Coalescer
 from omniscient.log import get_logger
+from omniscient.manifest import Manifest
+from omniscient.shipper import Shipper
+from omniscient.spool import MemorySpool, Spool
+from omniscient.store import ScriptStore
 
 log = get_logger()
-workers_scheduler = scheduler.Scheduler()
+workers_scheduler = None
 
 config = {}
+config_etag = None
 url = ""
-
-
+shipper = None
+manifest = None
+store = None
+coalescer = None
+aggregator = None
+running = {}
+ship_interval = 5.0
+ship_batch_size = 500
+spool_path = "/tmp/omniscient-spool"
+executor = "thread"
+spread = "hash"
+watch = False
+watch_timeout = 55
+
+
+@functools.lru_cache(maxsize=None)
 def get_uuid() -> str:
     """
-    Generate a UUID for this client
+    Generate a UUID for this client, computed once per process.
     """
 
     username = getpass.getuser()
@@ -37,23 +59,44 @@ def get_uuid() -> str:
     return str(uuid.uuid3(uuid.NAMESPACE_DNS, urn))
 
 
-def read_config(url: str) -> dict:
+def jittered(seconds: float, jitter: Optional[float] = 0.2) -> float:
+    """
+    Spread a delay randomly by +/- jitter of its length, so that workers
+    started at the same time don't keep calling home in lockstep.
+    """
+
+    return seconds * random.uniform(1 - jitter, 1 + jitter)
+
+
+def read_config(url: str, timeout: Optional[float] = None) -> Optional[dict]:
     """
-    Read configuration from server.
+    Read configuration from server. Returns None if the configuration
+    is unchanged since the last successful read.
     """
 
+    global config_etag
+
     config = {}
     my_uuid = get_uuid()
+    headers = {}
 
     log.debug(f"Worker have UUID {my_uuid}")
 
+    if config_etag:
+        headers["If-None-Match"] = config_etag
+
     try:
-        log.debug("Fetching configuration from " + url + "?uuid=" + my_uuid)
-        res = requests.get(url + "?uuid=" + my_uuid)
+        log.debug(f"Fetching configuration from {url} for {my_uuid}")
+        res = requests.get(url, params={"uuid": my_uuid}, headers=headers,
+                           timeout=timeout)
     except Exception:
         log.error("Could not reach endpoint " + url)
         return config
 
+    if res.status_code == 304:
+        log.debug("Configuration not modified")
+        return None
+
     if res.status_code != 200:
         log.debug(f"Server responded with {res.status_code}:\n" + res.text)
         return config
@@ -61,6 +104,7 @@ def read_config(url: str) -> dict:
     try:
         if "data" in res.json():
             config = res.json()["data"]
+            config_etag = res.headers.get("ETag")
         elif "error" in res.json():
             log.error("Configuration not found for client")
         else:
@@ -71,23 +115,16 @@ def read_config(url: str) -> dict:
     return config
 
 
-def callhome(result: dict) -> None:
+def callhome(result: list) -> None:
     """
-    Send result to server.
+    Queue result for the server, unless it is held back for
+    aggregation.
     """
 
-    try:
-        res = requests.post(url + "/callhome?uuid=" + get_uuid(), json=result)
-        log.debug("Sent result to server:")
-        indented = json.dumps(result, indent=4)
-        log.debug("\n" + indented)
+    result = aggregator.add(result)
 
-        if res.status_code != 200:
-            log.error(f"Server responded with {res.status_code}")
-        else:
-            log.debug("Server responded with 200 OK")
-    except Exception as e:
-        log.error(f"Failed to post result to {url}: {e}")
+    if result:
+        shipper.put(result)
 
 
 def check_error(event: JobEvent) -> None:
@@ -95,11 +132,17 @@ def check_error(event: JobEvent) -> None:
     Send error to server.
     """
 
+    fields = {"success": False}
+
+    if isinstance(event.exception, CheckTimeout):
+        fields["timeout"] = True
+
     result = [
         {
             "measurement": event.job_id,
             "tags": {"uuid": get_uuid()},
-            "fields": {"success": False},
+            "fields": fields,
+            "time": time.time_ns(),
         }
     ]
 
@@ -108,59 +151,112 @@ def check_error(event: JobEvent) -> None:
 
 def check_success(event: JobEvent) -> None:
     """
-    Send result to server.
+    Send result to server. A check can report several fields and tags at
+    once, see omniscient.result.
     """
 
-    try:
-        resultdata = event.retval.result.decode().rstrip()
-    except AttributeError:
-        return
-
-    try:
-        float(resultdata)
-    except ValueError:
-        pass
+    if isinstance(event.retval, dict):
+        # Plugins return their fields
+        points = [{"fields": event.retval, "tags": {}}]
     else:
-        resultdata = float(resultdata)
-
-    result = [
-        {
-            "measurement": event.job_id,
-            "tags": {"uuid": get_uuid()},
-            "fields": {"success": True, "result": resultdata},
-        }
-    ]
+        try:
+            points = result.parse(event.retval)
+        except AttributeError:
+            return
+        except (result.ResultError, UnicodeDecodeError) as e:
+            log.error(f"Invalid result from check {event.job_id}: {e}")
+            points = [{"fields": {"success": False}, "tags": {}}]
+
+    now = time.time_ns()
+    results = []
+
+    for point in points:
+        fields = dict(point["fields"])
+        fields.setdefault("success", True)
+
+        results.append(
+            {
+                "measurement": event.job_id,
+                "tags": dict(point["tags"], uuid=get_uuid()),
+                "fields": fields,
+                "time": point.get("time", now),
+            }
+        )
+
+    callhome(results)
+
+
+def check_key(test: dict) -> tuple:
+    """
+    Get the parts of a test that require its job to be updated when
+    they change.
+    """
 
-    callhome(result)
+    return (test["check"], test.get("hash"), test["args"], test["interval"],
+            test["retries"], test.get("timeout"), test.get("limits"))
 
 
-def start_checks(config: dict) -> None:
+def update_checks(config: list) -> None:
     """
-    Start all checks in configuration.
+    Bring the scheduled checks in line with the configuration, only
+    touching the checks that were added, removed or changed.
     """
 
-    for test in config:
-        interval = test["interval"]
-        name = test["name"]
-        test["url"] = url
-
-        print(f"Started check {name} with interval {interval}")
+    wanted = {test["name"]: test for test in config}
 
-        log.debug(f"Starting new job {name} with interval {interval}")
+    # One signed manifest covers all scripts, refreshed only if changed
+    manifest.update()
 
-        workers_scheduler.add(Check, name, interval=interval, maxruns=-1, config=test)
+    # Fetch all new and changed scripts at once instead of one by one
+    bundle.install(url, get_uuid(), config, store, manifest, session=shipper.session)
 
-    workers_scheduler.start()
+    for name in list(running):
+        if name not in wanted:
+            job_id, _, check = running.pop(name)
+            log.info(f"Removing check {name}")
+            workers_scheduler.delete_job(job_id)
+            aggregator.configure(job_id, None)
+            check.close()
 
+    for name, test in wanted.items():
+        interval = test["interval"]
+        test = dict(test, url=url)
+
+        if name not in running:
+            print(f"Started check {name} with interval {interval}")
+            log.debug(f"Starting new job {name} with interval {interval}")
+
+            check = Check(test, manifest=manifest, store=store, coalescer=coalescer)
+
+            if workers_scheduler.executor == "asyncio":
+                func = check.arun
+            else:
+                func = check.run
+
+            # Tests running the same script with the same arguments start
+            # in the same phase, so that their runs can be shared.
+            job_id = workers_scheduler.add(func, name, interval=interval,
+                                           maxruns=-1,
+                                           spread_key=f"{test['check']} {test['args']}")
+            running[name] = (job_id, test, check)
+        elif check_key(running[name][1]) != check_key(test):
+            log.info(f"Updating check {name} with interval {interval}")
+
+            job_id, _, check = running[name]
+            check.update(test)
+            workers_scheduler.update(job_id, interval=interval)
+            running[name] = (job_id, test, check)
+        else:
+            # Keep the latest test for what doesn't need a job update,
+            # such as its aggregation
+            job_id, _, check = running[name]
+            running[name] = (job_id, test, check)
 
-def stop_checks() -> None:
-    """
-    Stop all checks.
-    """
+    for job_id, test, _ in running.values():
+        aggregator.configure(job_id, test.get("aggregate"))
 
-    for job in workers_scheduler.get_jobs():
-        log.debug(f"Stopping job {job}")
-        workers_scheduler.delete_job(job)
+    # Drop script versions no check uses anymore
+    store.cleanup()
 
 
 def main() -> None:
@@ -168,29 +264,58 @@ def main() -> None:
     Main function.
     """
 
+    global shipper, manifest, store, coalescer, aggregator, workers_scheduler
+
     old_config = {}
     endpoint = url + "/config"
     callhome_interval = 30
+    timeout = 30
 
+    if watch:
+        # The server holds the request until the config changes
+        endpoint = url + f"/config/watch?timeout={watch_timeout}"
+        timeout = watch_timeout + 30
+
+    if spool_path:
+        spool = Spool(spool_path)
+    else:
+        spool = MemorySpool()
+
+    shipper = Shipper(url, get_uuid(), interval=ship_interval,
+                      batch_size=ship_batch_size, spool=spool)
+    shipper.start()
+
+    aggregator = Aggregator(shipper.put)
+    aggregator.start()
+
+    manifest = Manifest(url, session=shipper.session)
+    store = ScriptStore()
+    coalescer = Coalescer()
+
+    workers_scheduler = scheduler.Scheduler(executor=executor, spread=spread,
+                                            seed=get_uuid())
     workers_scheduler.add_error_listener(check_error)
     workers_scheduler.add_success_listener(check_success)
+    workers_scheduler.start()
 
     while True:
-        config = read_config(endpoint)
+        started = time.monotonic()
+        config = read_config(endpoint, timeout=timeout)
+
+        if config is None:
+            # A watch answered long before its timeout wasn't held by the
+            # server, poll until it has room for it again.
+            if watch and time.monotonic() - started >= watch_timeout / 2:
+                continue
+            log.info(f"Will call home again in about {callhome_interval} seconds")
+            time.sleep(jittered(callhome_interval))
+            continue
 
         if config == {}:
             log.debug("Didn't receive a configuration")
-            time.sleep(5)
+            time.sleep(jittered(5))
             continue
 
-        for item in old_config:
-            if "url" in item:
-                del item["url"]
-
-        for item in config:
-            if "url" in item:
-                del item["url"]
-
         if config != old_config:
             for test in config:
                 log.info("Scheduling test:")
@@ -201,14 +326,16 @@ def main() -> None:
                 log.info("")
 
             log.info("Configuration change!")
-            stop_checks()
-            start_checks(config)
+            update_checks(config)
+
+            old_config = config
 
-            old_config = config.copy()
+        if watch:
+            continue
 
-        log.info(f"Will call home again in {callhome_interval} seconds")
+        log.info(f"Will call home again in about {callhome_interval} seconds")
 
-        time.sleep(callhome_interval)
+        time.sleep(jittered(callhome_interval))
 
 
 def kill(pidfile: str) -> None:
@@ -244,13 +371,22 @@ def usage(err: Optional[str] = "") -> None:
     print("  -U              Print UUID and quit")
     print("  -u              URL to server")
     print("  -d              Enable debug")
+    print("  -i <seconds>    Interval between result batches (default 5)")
+    print("  -b <points>     Max number of results per batch (default 500)")
+    print("  -w              Watch the server for configuration changes instead")
+    print("                  of polling every 30 seconds")
+    print("  -a              Run checks on an asyncio event loop instead of threads")
+    print("  -S <strategy>   Spread of check start times over their interval,")
+    print("                  hash (default), random or none")
+    print("  -s <directory>  Spool directory for undelivered results")
+    print("                  (default /tmp/omniscient-spool, \"\" for memory only)")
 
     sys.exit(0)
 
 
 if __name__ == "__main__":
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "du:hU")
+        opts, args = getopt.getopt(sys.argv[1:], "du:hUi:b:s:aS:w")
     except getopt.GetoptError as e:
         usage(err=e)
 
@@ -262,6 +398,20 @@ if __name__ == "__main__":
         elif opt == "-U":
             print(get_uuid())
             sys.exit(0)
+        elif opt == "-i":
+            ship_interval = float(arg)
+        elif opt == "-b":
+            ship_batch_size = int(arg)
+        elif opt == "-s":
+            spool_path = arg
+        elif opt == "-a":
+            executor = "asyncio"
+        elif opt == "-w":
+            watch = True
+        elif opt == "-S":
+            if arg not in ("hash", "random", "none"):
+                usage(err=f"Unknown spread strategy {arg}")
+            spread = arg
         elif "-h":
             usage()
         else: